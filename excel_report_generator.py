@@ -5,9 +5,31 @@ Excel集計レポート生成ツール
 
 import openpyxl
 from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
 from openpyxl.chart import RadarChart, Reference, Series
 import os
+import re
+import sys
+import posixpath
+import weakref
+import csv
+import gc
+import json
+import bisect
+from array import array
+import io
+import mmap
+import shutil
+import struct
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, unescape
+from xml.etree import ElementTree
+from collections import namedtuple
+from copy import copy
+from urllib.parse import unquote
+from collections.abc import MutableMapping, Sequence
+from types import MappingProxyType
 from pathlib import Path
 from datetime import datetime
 import tkinter as tk
@@ -15,6 +37,1323 @@ from tkinter import filedialog, messagebox, ttk
 import traceback
 from openpyxl.styles import Border, Side, Alignment, Font, PatternFill, NamedStyle
 from openpyxl.formatting.rule import CellIsRule, FormulaRule
+from openpyxl.compat import safe_string
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import get_rels_path
+from openpyxl.styles.cell_style import CellStyle
+from openpyxl.styles.numbers import (
+    BUILTIN_FORMATS, BUILTIN_FORMATS_MAX_SIZE, builtin_format_code, is_date_format, is_timedelta_format
+)
+from openpyxl.utils import quote_sheetname
+from openpyxl.utils.datetime import from_excel, from_ISO8601
+from openpyxl.formula.translate import Translator
+from openpyxl.worksheet.formula import ArrayFormula
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.worksheet.copier import WorksheetCopy
+from openpyxl.xml.functions import tostring
+
+
+class PackedAnswers(Sequence):
+    """AnswerMatrix の1行分（1受講者の回答）を参照するビュー。値はアクセス時にビットから復元する"""
+
+    __slots__ = ('_matrix', '_offset')
+
+    def __init__(self, matrix, index):
+        self._matrix = matrix
+        self._offset = index * matrix.row_bytes
+
+    def __len__(self):
+        return self._matrix.question_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return (self._matrix.get_buffer()[self._offset + (i >> 3)] >> (i & 7)) & 1
+
+
+class QuestionScores(Sequence):
+    """
+    問題ごとの採点結果（{'question_num', 'section', 'point', 'correct'}）を、参照した時に回答から作るビュー
+    省メモリモードで、受講者ごとに問題数分の辞書を保持しないために使用する（並びは通常の採点結果と同じ）
+    """
+
+    __slots__ = ('_answers', '_points')
+
+    def __init__(self, answers, points_data):
+        self._answers = answers
+        self._points = points_data
+
+    def __len__(self):
+        return len(self._points)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        point_info = self._points[i]
+        index = point_info['question_num'] - 1
+        return {
+            'question_num': point_info['question_num'],
+            'section': point_info['section'],
+            'point': point_info['point'],
+            'correct': index < len(self._answers) and self._answers[index] == 1,
+        }
+
+
+class AnswerMatrix:
+    """
+    受講者×問題の回答（0/1）を1問1ビットに詰めて一時ファイルへ書き出し、mmapで参照する
+    大人数の試験で回答リストをすべてメモリに保持しないために使用する
+    with 文で使用するか、使用後に close を呼んで一時ファイルを削除する
+    """
+
+    def __init__(self, question_count):
+        self.question_count = question_count
+        self.row_bytes = (question_count + 7) // 8
+        self.row_count = 0
+        self.buffer = None
+        self.closed = False
+        self._file = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def get_buffer(self):
+        """メモリマップした回答データを取得（閉じた後は ValueError）"""
+        if self.closed:
+            raise ValueError("AnswerMatrix は閉じられているため、回答を参照できません")
+        return self.buffer
+
+    def append(self, answers):
+        """1受講者分の回答を追記"""
+        packed = bytearray(self.row_bytes)
+        for i, answer in enumerate(answers[:self.question_count]):
+            if answer == 1:
+                packed[i >> 3] |= 1 << (i & 7)
+        self._file.write(packed)
+        self.row_count += 1
+
+    def finalize(self, question_count=None):
+        """
+        書き込みを終了し、読み取り専用でメモリマップする
+        question_count を指定した場合、問題数をその数までに減らす（読み込み後に回答列の数が確定した場合）
+        """
+        if question_count is not None:
+            self.question_count = min(self.question_count, question_count)
+        self._file.flush()
+        if self.row_count > 0 and self.row_bytes > 0:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = b''
+
+    def row(self, index):
+        """index 番目の受講者の回答ビューを返す"""
+        return PackedAnswers(self, index)
+
+    def iter_chunks(self, chunk_size):
+        """chunk_size 人ずつ回答を復元して (開始インデックス, 回答リストのリスト) を返す"""
+        bits = range(self.question_count)
+        for start in range(0, self.row_count, chunk_size):
+            stop = min(start + chunk_size, self.row_count)
+            data = self.get_buffer()[start * self.row_bytes:stop * self.row_bytes]
+            chunk = []
+            for offset in range(0, len(data), self.row_bytes):
+                chunk.append([(data[offset + (i >> 3)] >> (i & 7)) & 1 for i in bits])
+            yield start, chunk
+
+    def close(self):
+        """一時ファイルを閉じる（以降、行ビューの参照や iter_chunks は ValueError になる）。複数回呼んでもよい"""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = None
+        self.closed = True
+        self._file.close()
+
+
+class RecordTable(Sequence):
+    """
+    受講者ごとの記録（入れ子の辞書）を、項目ごとの配列（int・float は array、それ以外はリスト）にまとめて保持する
+    省メモリモードで、受講者数分の辞書を保持しないために使用する
+    要素は辞書と同じように参照・更新できる RecordView（入れ子の辞書は参照のたびに作り直す）
+    read_only=True の場合、要素は変更できず、入れ子の辞書は読み取り専用で返す
+    """
+
+    def __init__(self, read_only=False):
+        self.columns = {}  # 項目のパス（キーのタプル）→ 値の配列
+        self.present = {}  # 一部の記録にしかない項目のパス → 値の有無（1行1バイト）
+        self.paths = {}  # 最上位のキー → その下の項目のパスのリスト
+        self.length = 0
+        self.read_only = read_only
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return RecordView(self, i)
+
+    @classmethod
+    def flatten(cls, value, path):
+        """入れ子の辞書を (項目のパス, 値) に分解する（空の辞書はそのまま1つの値として扱う）"""
+        if isinstance(value, dict) and value:
+            for key, item in value.items():
+                yield from cls.flatten(item, path + (key,))
+        else:
+            yield path, value
+
+    def append(self, record):
+        """記録（辞書）を追加"""
+        index = self.length
+        self.length += 1
+        for path, column in self.columns.items():
+            column.append(0 if isinstance(column, array) else None)
+            if path in self.present:
+                self.present[path].append(0)
+        for key, value in record.items():
+            self.set_value(index, key, value)
+        for path in self.columns:
+            if path[0] not in record:
+                self.mark_missing(path, index)
+
+    def copy(self, read_only=False):
+        """項目の配列をコピーした新しい RecordTable を作成"""
+        table = RecordTable(read_only=read_only)
+        table.columns = {path: column[:] for path, column in self.columns.items()}
+        table.present = {path: present[:] for path, present in self.present.items()}
+        table.paths = {key: list(paths) for key, paths in self.paths.items()}
+        table.length = self.length
+        return table
+
+    def has_value(self, path, index):
+        present = self.present.get(path)
+        return present is None or present[index] == 1
+
+    def mark_missing(self, path, index):
+        if path not in self.present:
+            self.present[path] = bytearray(b'\x01') * self.length
+        self.present[path][index] = 0
+
+    def get_value(self, index, key):
+        """index 番目の記録の key の値を取得（入れ子の辞書は作り直す）"""
+        found = False
+        value = None
+        for path in self.paths.get(key, ()):
+            if not self.has_value(path, index):
+                continue
+            item = self.columns[path][index]
+            if len(path) == 1:
+                return freeze(item) if self.read_only else item
+            if not found:
+                value, found = {}, True
+            node = value
+            for part in path[1:-1]:
+                node = node.setdefault(part, {})
+            node[path[-1]] = item
+        if not found:
+            raise KeyError(key)
+        return freeze(value) if self.read_only else value
+
+    def set_value(self, index, key, value):
+        """index 番目の記録の key に値を設定"""
+        if self.read_only:
+            raise TypeError("読み取り専用の記録は変更できません")
+        leaves = dict(self.flatten(value, (key,)))
+        # 以前の値（ほかの記録の値）にあって新しい値にない項目は、値がないものとする
+        for path in self.paths.get(key, ()):
+            if path not in leaves:
+                self.mark_missing(path, index)
+        for path, item in leaves.items():
+            column = self.columns.get(path)
+            if column is None:
+                if type(item) is float:
+                    column = array('d', bytes(8 * self.length))
+                elif type(item) is int:
+                    column = array('q', bytes(8 * self.length))
+                else:
+                    column = [None] * self.length
+                self.columns[path] = column
+                self.paths.setdefault(key, []).append(path)
+                if self.length > 1:
+                    self.present[path] = bytearray(self.length)
+            if isinstance(column, array):
+                try:
+                    if type(item) is not (float if column.typecode == 'd' else int):
+                        raise TypeError(item)
+                    column[index] = item
+                except (TypeError, OverflowError):
+                    # 型が異なる値はリストで保持する
+                    column = self.columns[path] = list(column)
+            if isinstance(column, list):
+                column[index] = item
+            if path in self.present:
+                self.present[path][index] = 1
+
+    def delete_value(self, index, key):
+        """index 番目の記録から key を削除"""
+        if self.read_only:
+            raise TypeError("読み取り専用の記録は変更できません")
+        self.get_value(index, key)  # ない場合は KeyError
+        for path in self.paths[key]:
+            self.mark_missing(path, index)
+
+    def iter_keys(self, index):
+        for key, paths in self.paths.items():
+            if any(self.has_value(path, index) for path in paths):
+                yield key
+
+
+class RecordView(MutableMapping):
+    """RecordTable の1件分を辞書として参照・更新するビュー"""
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._table.get_value(self._index, key)
+
+    def __setitem__(self, key, value):
+        self._table.set_value(self._index, key, value)
+
+    def __delitem__(self, key):
+        self._table.delete_value(self._index, key)
+
+    def __iter__(self):
+        return self._table.iter_keys(self._index)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class SheetNameRegistry:
+    """
+    実行中に使用するシート名を管理する
+    Excelのシート名規則（使用禁止文字、31文字制限、大文字小文字を区別しない重複判定）を適用し、
+    重複時はメールアドレスまたは連番で一意な名前を決める
+    """
+
+    MAX_LENGTH = 31
+    INVALID_CHARS = re.compile(r'[\\/?*\[\]:]')
+
+    def __init__(self, existing_names=(), reserved_names=()):
+        # 既存シート（同名のレポートは置き換える）: 小文字 → 実際のシート名
+        self._existing = {name.lower(): name for name in existing_names}
+        # 置き換えてはいけないシート名（取得データ・配点・テンプレート・集計シートなど）
+        self._reserved = {name.lower() for name in reserved_names}
+        self._reserved.add('history')  # Excelの予約名
+        # 今回の実行で割り当て済みのシート名
+        self._claimed = set()
+        # 割り当て結果（氏名, メールアドレス, シート名）
+        self.mapping = []
+
+    def sanitize(self, name, max_length=MAX_LENGTH):
+        """Excelで使用できないシート名の文字を置換し、長さを制限する"""
+        sheet_name = self.INVALID_CHARS.sub('_', str(name)).strip()
+        sheet_name = sheet_name[:max_length].strip("'")
+        return sheet_name or 'シート'
+
+    def is_available(self, sheet_name):
+        """今回の実行で未使用かつ予約されていないシート名か"""
+        key = sheet_name.lower()
+        return key not in self._claimed and key not in self._reserved
+
+    def register(self, name, email=''):
+        """
+        氏名からシート名を割り当てる
+        戻り値: (シート名, 置き換える既存シート名 または None)
+        """
+        base_name = self.sanitize(name)
+        candidates = [base_name]
+
+        # 重複時はメールアドレスのローカル部で区別する
+        local_part = str(email).split('@')[0] if email else ''
+        if local_part:
+            suffix = f"({self.sanitize(local_part, max_length=15)})"
+            candidates.append(self.sanitize(name, max_length=self.MAX_LENGTH - len(suffix)) + suffix)
+
+        sheet_name = next((c for c in candidates if self.is_available(c)), None)
+
+        # それでも重複する場合は連番を付ける
+        number = 2
+        while sheet_name is None:
+            suffix = f"({number})"
+            candidate = self.sanitize(name, max_length=self.MAX_LENGTH - len(suffix)) + suffix
+            if self.is_available(candidate):
+                sheet_name = candidate
+            number += 1
+
+        key = sheet_name.lower()
+        self._claimed.add(key)
+        self.mapping.append((name, email, sheet_name))
+        return sheet_name, self._existing.pop(key, None)
+
+
+class SheetRowSpool:
+    """
+    シートに書き込んだ行を一定行数ごとに一時ファイルへXMLとして書き出し、シートから削除する
+    大人数の集計シートのセルをすべてメモリに保持しないために使用する（XlsmAppendWriter で保存する場合のみ）
+    書き出した行は XlsmAppendWriter がシートを書き込む際に sheetData に挿入する
+    """
+
+    def __init__(self, sheet, first_row, chunk_size):
+        self.sheet = sheet
+        self.first_row = first_row  # 書き出す最初の行（見出し行より下）
+        self.last_row = first_row - 1  # 書き出した最後の行
+        self.max_column = 0
+        self.chunk_size = chunk_size
+        self._file = tempfile.TemporaryFile()
+
+    def row_written(self, row):
+        """row 行目まで書き込んだことを通知する（chunk_size 行たまったら書き出す）"""
+        if row - self.last_row >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """まだ書き出していない行（first_row 以降）を書き出し、シートから削除する"""
+        sheet = self.sheet
+        max_row = sheet.max_row
+        if max_row <= self.last_row:
+            return
+        for row in sheet.iter_rows(min_row=self.last_row + 1, max_row=max_row):
+            cells = [self.cell_xml(cell) for cell in row if cell.value is not None or cell.has_style]
+            if cells:
+                self.max_column = max(self.max_column, row[-1].column)
+                self._file.write(f'<row r="{row[0].row}">{"".join(cells)}</row>'.encode('utf-8'))
+        sheet.delete_rows(self.last_row + 1, max_row - self.last_row)
+        self.last_row = max_row
+
+    @staticmethod
+    def cell_xml(cell):
+        """セルのXMLを作成（文字列はインライン文字列として書き込む）"""
+        attributes = f' r="{cell.coordinate}"'
+        if cell.has_style:
+            attributes += f' s="{cell.style_id}"'
+        value = cell.value
+        if value is None:
+            return f'<c{attributes}/>'
+        if cell.data_type == 'f':
+            return f'<c{attributes}><f>{escape(value[1:])}</f></c>'
+        if cell.data_type == 's':
+            space = ' xml:space="preserve"' if value != value.strip() else ''
+            return f'<c{attributes} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+        if cell.data_type == 'b':
+            return f'<c{attributes} t="b"><v>{int(value)}</v></c>'
+        if cell.data_type == 'n':
+            return f'<c{attributes} t="n"><v>{safe_string(value)}</v></c>'
+        raise TypeError(f"セル {cell.coordinate} の値 {value!r} は書き出せません")
+
+    def write_to(self, stream):
+        """書き出した行を stream にコピーする"""
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, stream)
+        self._file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self._file.close()
+
+
+class XlsmAppendWriter:
+    """
+    元の.xlsmファイルのパーツ（取得データ、マクロ、既存シートなど）はバイト単位でそのままコピーし、
+    今回追加・置き換えたシートとそのグラフ・描画パーツだけを書き込んで保存する
+    更新するのは workbook.xml、workbook.xml.rels、[Content_Types].xml と、styles.xml への書式の追記のみ
+    置き換え・削除したシートからしか参照されていないパーツ（描画・グラフなど）はコピーしない
+    keep_original_sheets=False の場合、元のシート・定義名・マクロは含めず、新しいシートだけのファイル（.xlsx）にする
+    （書式・テーマなどブック全体のパーツは元のファイルのものを使う）
+    """
+
+    WORKBOOK_PART = 'xl/workbook.xml'
+    WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+    CONTENT_TYPES_PART = '[Content_Types].xml'
+    STYLES_PART = 'xl/styles.xml'
+    CALC_CHAIN_PART = 'xl/calcChain.xml'
+    WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+    RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    MACRO_WORKBOOK_CONTENT_TYPE = 'application/vnd.ms-excel.sheet.macroEnabled.main+xml'
+    WORKBOOK_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'
+
+    # 属性値は二重引用符・単一引用符のどちらで囲まれていてもよい
+    ATTRIBUTE_PATTERN = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+    # styles.xml の書式の一覧（一覧の要素名, 各書式の要素名）。新しいシートで増えた書式を末尾に追記する
+    STYLE_LISTS = (('fonts', 'font'), ('fills', 'fill'), ('borders', 'border'), ('cellXfs', 'xf'), ('dxfs', 'dxf'))
+
+    def __init__(self, source_path, workbook, original_sheets, keep_original_sheets=True, row_spools=()):
+        self.source_path = source_path
+        self.workbook = workbook
+        # 読み込み時点のシート（これ以外のシートを新規シートとして書き込む）
+        self.original_sheets = original_sheets
+        self.keep_original_sheets = keep_original_sheets
+        # 行を一時ファイルに書き出したシート（シートの書き込み時に書き出した行を挿入する）
+        self.row_spools = {id(spool.sheet): spool for spool in row_spools}
+        self.source = None
+        self.target = None
+
+    @classmethod
+    def parse_attributes(cls, element):
+        """XML要素の文字列から属性の辞書を取得"""
+        attributes = {}
+        for match in cls.ATTRIBUTE_PATTERN.finditer(element):
+            value = match.group(2) if match.group(2) is not None else match.group(3)
+            attributes[match.group(1)] = unescape(value, {'&quot;': '"', '&apos;': "'"})
+        return attributes
+
+    @staticmethod
+    def quote_attribute(value):
+        """属性値として書き込めるよう文字列をエスケープ"""
+        return escape(str(value), {'"': '&quot;'})
+
+    @staticmethod
+    def resolve_target(part, target):
+        """リレーションシップの Target を zip 内のパスに変換（part は参照元のパーツ、パッケージのルートは ''）"""
+        target = unquote(target)
+        if target.startswith('/'):
+            return target[1:]
+        return posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+
+    @classmethod
+    def get_part_path(cls, target):
+        """workbook.xml.rels の Target を zip 内のパスに変換"""
+        return cls.resolve_target(cls.WORKBOOK_PART, target)
+
+    @staticmethod
+    def get_rels_part(part):
+        """パーツのリレーションシップ（.rels）のパスを取得（パッケージのルートは ''）"""
+        return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+    @staticmethod
+    def get_rels_owner(rels_part):
+        """リレーションシップ（.rels）のパスから参照元のパーツのパスを取得"""
+        folder = posixpath.dirname(posixpath.dirname(rels_part))
+        return posixpath.join(folder, posixpath.basename(rels_part)[:-len('.rels')])
+
+    @staticmethod
+    def copy_compressed_part(source, target, info):
+        """
+        source の info のパーツを、展開・再圧縮せずに圧縮されたままのデータで target に追加する
+        （圧縮方式・CRC・サイズは元のパーツのまま。zipfile には圧縮済みのデータを書き込む公開APIがないため、
+        ZipFile.fp・filelist・NameToInfo・start_dir を直接使う。暗号化されたパーツは展開してコピーする）
+        """
+        if info.flag_bits & 0x1:
+            with source.open(info) as src, target.open(info.filename, 'w') as dst:
+                shutil.copyfileobj(src, dst)
+            return
+        # ローカルファイルヘッダー（固定長30バイト + ファイル名 + 拡張フィールド）の後に圧縮データがある
+        source.fp.seek(info.header_offset)
+        header = source.fp.read(30)
+        if len(header) != 30 or header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f"{info.filename} のヘッダーを読み取れません")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        source.fp.seek(info.header_offset + 30 + name_length + extra_length)
+
+        copied = zipfile.ZipInfo(info.filename, info.date_time)
+        copied.compress_type = info.compress_type
+        copied.CRC = info.CRC
+        copied.compress_size = info.compress_size
+        copied.file_size = info.file_size
+        copied.external_attr = info.external_attr
+        copied.header_offset = target.fp.tell()
+        target.fp.write(copied.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            data = source.fp.read(min(remaining, 1024 * 1024))
+            if not data:
+                raise zipfile.BadZipFile(f"{info.filename} のデータが途中で終わっています")
+            target.fp.write(data)
+            remaining -= len(data)
+        target.filelist.append(copied)
+        target.NameToInfo[copied.filename] = copied
+        target.start_dir = target.fp.tell()
+
+    @classmethod
+    def iter_relationships(cls, rels_xml):
+        """リレーションシップの要素ごとに (要素の文字列, 属性の辞書) を返す"""
+        for element in re.findall(r'<Relationship\b[^>]*/>', rels_xml):
+            yield element, cls.parse_attributes(element)
+
+    @classmethod
+    def get_sheet_parts(cls, archive):
+        """workbook.xml のシートの順に (シート名, シートのパーツのパス) のリストを取得"""
+        workbook_xml = archive.read(cls.WORKBOOK_PART).decode('utf-8-sig')
+        rels_xml = archive.read(cls.WORKBOOK_RELS_PART).decode('utf-8-sig')
+        targets = {attributes['Id']: cls.get_part_path(attributes['Target'])
+                   for element, attributes in cls.iter_relationships(rels_xml)}
+        sheet_parts = []
+        for element in re.findall(r'<sheet\b[^>]*/>', workbook_xml):
+            attributes = cls.parse_attributes(element)
+            rid = next((value for key, value in attributes.items() if key.endswith(':id')), None)
+            sheet_parts.append((attributes['name'], targets.get(rid)))
+        return sheet_parts
+
+    def next_number(self, names, pattern):
+        """既存パーツ名の連番の次の番号を取得"""
+        numbers = [int(m.group(1)) for m in (re.match(pattern, name) for name in names) if m]
+        return max(numbers, default=0) + 1
+
+    def save(self, output_path):
+        """新しいシートのパーツを追加した.xlsmファイルを output_path に保存"""
+        self.open(output_path)
+        try:
+            self.write_sheets()
+            self.close()
+        except Exception:
+            self.abort()
+            raise
+
+    def open(self, output_path):
+        """保存を開始する（write_sheets で新しいシートを書き込み、close で保存を完了する）"""
+        self.source = zipfile.ZipFile(self.source_path)
+        self.source_names = {info.filename for info in self.source.infolist() if not info.is_dir()}
+        self.target = zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.output_path = output_path
+        self.written = []  # 書き込んだシート: {'title', 'path', 'defined_names'}
+        self.written_sheets = weakref.WeakSet()
+        self.new_overrides = []
+        self.next_sheet = self.next_number(self.source_names, r'xl/worksheets/sheet(\d+)\.xml$')
+        self.next_drawing = self.next_number(self.source_names, r'xl/drawings/drawing(\d+)\.xml$')
+        self.next_chart = self.next_number(self.source_names, r'xl/charts/chart(\d+)\.xml$')
+        return self
+
+    def abort(self):
+        """保存を中止してファイルを閉じる"""
+        for archive in (self.target, self.source):
+            if archive is not None:
+                archive.close()
+        self.source = self.target = None
+
+    def get_defined_names(self, ws):
+        """シートの定義名（シート固有の名前、オートフィルター、印刷タイトル、印刷範囲）を取得"""
+        defined_names = [copy(defined_name) for defined_name in ws.defined_names.values()]
+        if ws.auto_filter:
+            defined_names.append(DefinedName(
+                name='_FilterDatabase', hidden=True, attr_text=f"{quote_sheetname(ws.title)}!{ws.auto_filter}"
+            ))
+        if ws.print_titles:
+            defined_names.append(DefinedName(name='Print_Titles', attr_text=ws.print_titles))
+        if ws.print_area:
+            defined_names.append(DefinedName(name='Print_Area', attr_text=ws.print_area))
+        return defined_names
+
+    def write_sheets(self, worksheets=None):
+        """
+        新しいシート（と、そのグラフ・描画）を書き込む
+        worksheets を省略した場合、まだ書き込んでいない新しいシートをすべて書き込む
+        書き込んだシートはワークブックから削除してもよい（シートの定義は close で workbook.xml に追加する）
+        """
+        if worksheets is None:
+            original_ids = {id(sheet) for sheet in self.original_sheets}
+            worksheets = [
+                ws for ws in self.workbook.worksheets
+                if id(ws) not in original_ids and ws not in self.written_sheets
+            ]
+
+        target = self.target
+        for ws in worksheets:
+            if ws._comments or ws._tables or ws._pivots or ws._images or ws.legacy_drawing:
+                raise Exception(
+                    f"シート「{ws.title}」にコメント・テーブル・ピボット・画像が含まれるため、追記モードでは保存できません"
+                )
+            ws._id = self.next_sheet
+            self.next_sheet += 1
+            # テンプレートの選択状態をコピーしないようにする（複数シートがグループ化されるのを防ぐ）
+            ws.sheet_view.tabSelected = False
+
+            ws._drawing = SpreadsheetDrawing()
+            ws._drawing.charts = ws._charts
+            ws._drawing.images = ws._images
+            writer = WorksheetWriter(ws)
+            writer.write()
+            ws._rels = writer._rels
+            if id(ws) in self.row_spools:
+                self.write_spooled_sheet(writer.out, ws.path[1:], self.row_spools[id(ws)])
+            else:
+                target.write(writer.out, ws.path[1:])
+            writer.cleanup()
+            self.new_overrides.append((ws.path, ws.mime_type))
+
+            if ws._drawing:
+                drawing = ws._drawing
+                drawing._id = self.next_drawing
+                self.next_drawing += 1
+                for chart in drawing.charts:
+                    chart._id = self.next_chart
+                    self.next_chart += 1
+                    target.writestr(chart.path[1:], tostring(chart._write()))
+                    self.new_overrides.append((chart.path, chart.mime_type))
+                target.writestr(drawing.path[1:], tostring(drawing._write()))
+                target.writestr(get_rels_path(drawing.path)[1:], tostring(drawing._write_rels()))
+                self.new_overrides.append((drawing.path, drawing.mime_type))
+                for rel in ws._rels:
+                    if 'drawing' in rel.Type:
+                        rel.Target = drawing.path
+
+            if ws._rels:
+                target.writestr(get_rels_path(ws.path)[1:], tostring(ws._rels.to_tree()))
+
+            self.written.append({
+                'title': ws.title,
+                'path': ws.path,
+                'defined_names': self.get_defined_names(ws),
+            })
+            self.written_sheets.add(ws)
+
+    def write_spooled_sheet(self, sheet_xml_path, part, spool):
+        """一時ファイルに書き出した行を、書き出した行より下の最初の行（平均行など）の前に挿入してシートを書き込む"""
+        with open(sheet_xml_path, encoding='utf-8') as f:
+            sheet_xml = f.read()  # 書き出した行を除いたシート（見出し行など）のみ
+        sheet_xml = re.sub(r'<sheetData\s*/>', '<sheetData></sheetData>', sheet_xml, count=1)
+        position = next(
+            (match.start() for match in re.finditer(r'<row\b[^>]*\br="(\d+)"', sheet_xml)
+             if int(match.group(1)) > spool.last_row),
+            sheet_xml.find('</sheetData>')
+        )
+
+        # シートの範囲（<dimension>）に書き出した行を含める
+        sheet = spool.sheet
+        max_row = max(sheet.max_row, spool.last_row)
+        max_column = max(sheet.max_column, spool.max_column)
+        dimension = f"{get_column_letter(sheet.min_column)}{min(sheet.min_row, spool.first_row)}:{get_column_letter(max_column)}{max_row}"
+        head = re.sub(r'(<dimension\b[^>]*\bref=)"[^"]*"', lambda m: f'{m.group(1)}"{dimension}"', sheet_xml[:position], count=1)
+
+        with self.target.open(part, 'w') as stream:
+            stream.write(head.encode('utf-8'))
+            spool.write_to(stream)
+            stream.write(sheet_xml[position:].encode('utf-8'))
+
+    def close(self):
+        """workbook.xml・リレーションシップ・コンテンツタイプ・スタイルを更新し、元のパーツをコピーして保存を完了する"""
+        self.write_sheets()
+        source = self.source
+        target = self.target
+        workbook_xml = source.read(self.WORKBOOK_PART).decode('utf-8-sig')
+        rels_xml = source.read(self.WORKBOOK_RELS_PART).decode('utf-8-sig')
+        content_types_xml = source.read(self.CONTENT_TYPES_PART).decode('utf-8-sig')
+
+        # workbook.xml のリレーションシップ名前空間の接頭辞（通常は r）
+        prefix_match = re.search(
+            r'xmlns:(\w+)\s*=\s*["\']' + re.escape(self.RELATIONSHIPS_NS) + r'["\']', workbook_xml
+        )
+        rid_attr = f"{prefix_match.group(1) if prefix_match else 'r'}:id"
+
+        # 既存のシート定義（workbook.xml の順）とリレーションシップ
+        sheet_entries = []
+        for element in re.findall(r'<sheet\b[^>]*/>', workbook_xml):
+            attributes = self.parse_attributes(element)
+            sheet_entries.append({
+                'element': element,
+                'key': attributes['name'].lower(),
+                'sheet_id': int(attributes['sheetId']),
+                'rid': attributes[rid_attr],
+            })
+        rels = {attributes['Id']: {'element': element, 'target': attributes['Target'], 'type': attributes['Type']}
+                for element, attributes in self.iter_relationships(rels_xml)}
+
+        if self.keep_original_sheets:
+            # 読み込み後に削除されずに残っている元のシート
+            original_ids = {id(sheet) for sheet in self.original_sheets}
+            remaining_names = {
+                sheet.title.lower()
+                for sheet in self.workbook.worksheets + self.workbook.chartsheets
+                if id(sheet) in original_ids
+            }
+            written_by_key = {entry['title'].lower(): entry for entry in self.written}
+        else:
+            # 元のシートはすべて除き、新しいシートは同名の元のシートがあっても末尾に追加する
+            remaining_names = set()
+            written_by_key = {}
+
+        next_rid = max([int(rid[3:]) for rid in rels if rid[3:].isdigit()], default=0) + 1
+        next_sheet_id = max([entry['sheet_id'] for entry in sheet_entries], default=0) + 1
+
+        sheet_elements = []  # 出力するシート定義（順番どおり）
+        index_map = {}  # 残す元のシートの番号 → 出力後の番号（定義名の localSheetId の更新に使用）
+        replaced = set()
+        for index, entry in enumerate(sheet_entries):
+            rel = rels[entry['rid']]
+            if entry['key'] in remaining_names:
+                index_map[index] = len(sheet_elements)
+                sheet_elements.append(entry['element'])
+            elif entry['key'] in written_by_key:
+                # 同名の新しいシートがあれば、シートの位置とIDを引き継いで参照先だけ置き換える
+                new_entry = written_by_key[entry['key']]
+                new_entry['index'] = len(sheet_elements)
+                replaced.add(entry['key'])
+                sheet_elements.append(entry['element'])
+                rels_xml = rels_xml.replace(
+                    rel['element'],
+                    f'<Relationship Id="{entry["rid"]}" Type="{self.WORKSHEET_REL_TYPE}" '
+                    f'Target="{self.quote_attribute(new_entry["path"])}"/>'
+                )
+            else:
+                # 置き換えられずに削除された元のシートは定義からも削除する
+                rels_xml = rels_xml.replace(rel['element'], '')
+
+        for new_entry in self.written:
+            if new_entry['title'].lower() in replaced:
+                continue
+            rid = f"rId{next_rid}"
+            next_rid += 1
+            new_entry['index'] = len(sheet_elements)
+            sheet_elements.append(
+                f'<sheet name="{self.quote_attribute(new_entry["title"])}" sheetId="{next_sheet_id}" {rid_attr}="{rid}"/>'
+            )
+            next_sheet_id += 1
+            rels_xml = rels_xml.replace(
+                '</Relationships>',
+                f'<Relationship Id="{rid}" Type="{self.WORKSHEET_REL_TYPE}" '
+                f'Target="{self.quote_attribute(new_entry["path"])}"/></Relationships>'
+            )
+
+        sheets_match = re.search(r'<sheets\b[^>]*>.*?</sheets>', workbook_xml, re.S)
+        workbook_xml = (
+            workbook_xml[:sheets_match.start()] + '<sheets>' + ''.join(sheet_elements) + '</sheets>'
+            + workbook_xml[sheets_match.end():]
+        )
+        workbook_xml = self.update_defined_names(workbook_xml, index_map)
+        # 表示中・先頭のシート番号が範囲外にならないようにする（シートを削除した場合）
+        workbook_xml = re.sub(
+            r'\b(activeTab|firstSheet)=(["\'])(\d+)\2',
+            lambda m: m.group(0) if int(m.group(3)) < len(sheet_elements) else f'{m.group(1)}="0"',
+            workbook_xml
+        )
+
+        # 計算チェーンは参照先が変わるため削除する（Excelが開く際に再作成する）
+        for rel in rels.values():
+            if self.get_part_path(rel['target']) == self.CALC_CHAIN_PART:
+                rels_xml = rels_xml.replace(rel['element'], '')
+            elif not self.keep_original_sheets and rel['type'].endswith(('/vbaProject', '/sharedStrings')):
+                # マクロと共有文字列は元のシートでのみ使う（新しいシートの文字列はセルに直接書き込まれる）
+                rels_xml = rels_xml.replace(rel['element'], '')
+
+        # 新しいシートの数式はキャッシュ値がないため、開く際に再計算させる
+        calc_match = re.search(r'<calcPr\b[^>]*?/?>', workbook_xml)
+        if calc_match and 'fullCalcOnLoad' not in calc_match.group(0):
+            calc_element = calc_match.group(0)
+            workbook_xml = workbook_xml.replace(
+                calc_element, calc_element.replace('<calcPr', '<calcPr fullCalcOnLoad="1"', 1)
+            )
+
+        # 元のパーツのうち、パッケージのルートからリレーションシップで参照されているものだけをコピーする
+        # （置き換え・削除したシートとその描画・グラフ、計算チェーンはコピーしない）
+        rewritten_parts = {
+            self.STYLES_PART, self.WORKBOOK_PART, self.WORKBOOK_RELS_PART, self.CONTENT_TYPES_PART
+        }
+        referenced_parts = self.find_referenced_parts(rels_xml)
+        copied_parts = set()
+        for name in self.source_names - rewritten_parts:
+            if name.endswith('.rels'):
+                owner = self.get_rels_owner(name)
+                if owner == '' or owner in referenced_parts:
+                    copied_parts.add(name)
+            elif name in referenced_parts:
+                copied_parts.add(name)
+        skipped_parts = self.source_names - rewritten_parts - copied_parts
+
+        def remove_override(match):
+            part_name = unquote(self.parse_attributes(match.group(0)).get('PartName', '')).lstrip('/')
+            return '' if part_name in skipped_parts else match.group(0)
+
+        content_types_xml = re.sub(r'<Override\b[^>]*/>', remove_override, content_types_xml)
+        if not self.keep_original_sheets:
+            # マクロを含めないため、通常のブック（.xlsx）にする
+            content_types_xml = content_types_xml.replace(self.MACRO_WORKBOOK_CONTENT_TYPE, self.WORKBOOK_CONTENT_TYPE)
+        content_types_xml = content_types_xml.replace('</Types>', ''.join(
+            f'<Override PartName="{self.quote_attribute(path)}" ContentType="{mime_type}"/>'
+            for path, mime_type in self.new_overrides
+        ) + '</Types>')
+
+        # 新しいシートのセルで使う書式を元のスタイルシートに追記する（シートの書き込み後に作成する）
+        target.writestr(self.STYLES_PART, self.merge_styles(source.read(self.STYLES_PART).decode('utf-8-sig')))
+        target.writestr(self.WORKBOOK_PART, workbook_xml)
+        target.writestr(self.WORKBOOK_RELS_PART, rels_xml)
+        target.writestr(self.CONTENT_TYPES_PART, content_types_xml)
+
+        # それ以外の元のパーツは圧縮されたままコピーする
+        for info in source.infolist():
+            if info.filename in copied_parts:
+                self.copy_compressed_part(source, target, info)
+
+        self.abort()
+        if isinstance(self.output_path, (str, os.PathLike)):
+            self.verify(self.output_path, copied_parts)
+
+    def update_defined_names(self, workbook_xml, index_map):
+        """
+        定義名を更新する
+        残す元のシートの定義名は localSheetId を出力後のシート番号にし、置き換え・削除したシートの定義名は削除する
+        元のシートを含めない場合は、ブック全体の定義名も削除する（元のシートを参照しているため）
+        新しいシートの定義名（印刷範囲・印刷タイトルなど）を追加する
+        """
+        names_match = re.search(r'<definedNames\b[^>]*?(?:/>|>(.*?)</definedNames>)', workbook_xml, re.S)
+        defined_names = []
+        if names_match and names_match.group(1):
+            for element in re.findall(r'<definedName\b[^>]*?(?:/>|>.*?</definedName>)', names_match.group(1), re.S):
+                opening = re.match(r'<definedName\b[^>]*>', element).group(0)
+                local_sheet_id = self.parse_attributes(opening).get('localSheetId')
+                if local_sheet_id is None:
+                    if self.keep_original_sheets:
+                        defined_names.append(element)
+                elif int(local_sheet_id) in index_map:
+                    new_opening = re.sub(
+                        r'\blocalSheetId=(["\'])\d+\1', f'localSheetId="{index_map[int(local_sheet_id)]}"', opening
+                    )
+                    defined_names.append(new_opening + element[len(opening):])
+        for new_entry in self.written:
+            for defined_name in new_entry['defined_names']:
+                defined_name.localSheetId = new_entry['index']
+                defined_names.append(tostring(defined_name.to_tree()).decode('utf-8'))
+
+        names_xml = f"<definedNames>{''.join(defined_names)}</definedNames>" if defined_names else ''
+        if names_match:
+            return workbook_xml[:names_match.start()] + names_xml + workbook_xml[names_match.end():]
+        if names_xml:
+            # definedNames は sheets（functionGroups、externalReferences があればその後）の直後に置く
+            position = max(m.end() for m in re.finditer(
+                r'</sheets>|<functionGroups\b[^>]*/>|</functionGroups>|</externalReferences>', workbook_xml
+            ))
+            return workbook_xml[:position] + names_xml + workbook_xml[position:]
+        return workbook_xml
+
+    def find_referenced_parts(self, workbook_rels_xml):
+        """パッケージのルートからリレーションシップをたどり、参照されている元のパーツのパスを取得"""
+        referenced = set()
+        pending = ['']
+        while pending:
+            part = pending.pop()
+            rels_part = self.get_rels_part(part)
+            if part == self.WORKBOOK_PART:
+                rels_xml = workbook_rels_xml
+            elif rels_part in self.source_names:
+                rels_xml = self.source.read(rels_part).decode('utf-8-sig')
+            else:
+                continue
+            for element, attributes in self.iter_relationships(rels_xml):
+                if attributes.get('TargetMode') == 'External':
+                    continue
+                target = self.resolve_target(part, attributes['Target'])
+                if target not in referenced:
+                    referenced.add(target)
+                    pending.append(target)
+        return referenced
+
+    def merge_styles(self, styles_xml):
+        """
+        元の styles.xml に、新しいシートで増えた書式（フォント・塗りつぶし・罫線・セル書式・条件付き書式・表示形式）だけを追記する
+        openpyxl は読み込んだ書式を元の順番のまま保持して新しい書式を末尾に追加するため、
+        元の書式の番号は変わらず、追記した書式の番号もワークブック上の番号と一致する
+        """
+        workbook = self.workbook
+        items = {
+            'fonts': workbook._fonts,
+            'fills': workbook._fills,
+            'borders': workbook._borders,
+            'cellXfs': workbook._cell_styles,
+            'dxfs': workbook._differential_styles.styles,
+        }
+
+        # 元の表示形式（書式コード → ID）。openpyxl は独自の表示形式のIDを164から振り直すため、元のIDに戻す
+        custom_formats = {}
+        for element in re.findall(r'<numFmt\b[^>]*/>', styles_xml):
+            attributes = self.parse_attributes(element)
+            custom_formats[int(attributes['numFmtId'])] = attributes['formatCode']
+        format_ids = {}
+        for format_id, code in sorted(custom_formats.items(), reverse=True):
+            format_ids[code] = format_id
+        next_format_id = max([BUILTIN_FORMATS_MAX_SIZE] + [format_id + 1 for format_id in custom_formats])
+        new_formats = []
+
+        for list_tag, item_tag in self.STYLE_LISTS:
+            match = re.search(rf'<{list_tag}\b[^>]*?(?:/>|>(.*?)</{list_tag}>)', styles_xml, re.S)
+            if match is None and list_tag != 'dxfs':
+                raise Exception(f"styles.xml に {list_tag} がないため、追記モードでは保存できません")
+            original_count = len(re.findall(rf'<{item_tag}\b', match.group(1) or '')) if match else 0
+            if len(items[list_tag]) < original_count:
+                raise Exception("元のファイルの書式をワークブックと対応付けられないため、追記モードでは保存できません")
+            new_items = items[list_tag][original_count:]
+            if not new_items:
+                continue
+
+            elements = []
+            for item in new_items:
+                if list_tag == 'cellXfs':
+                    xf = CellStyle.from_array(item)
+                    if item.alignmentId:
+                        xf.alignment = workbook._alignments[item.alignmentId]
+                    if item.protectionId:
+                        xf.protection = workbook._protections[item.protectionId]
+                    # 表示形式を元のファイルのIDにする（ない書式は追加する）
+                    if item.numFmtId < BUILTIN_FORMATS_MAX_SIZE:
+                        code = BUILTIN_FORMATS.get(item.numFmtId)
+                        overridden = item.numFmtId in custom_formats and code is not None and custom_formats[item.numFmtId] != code
+                    else:
+                        code = workbook._number_formats[item.numFmtId - BUILTIN_FORMATS_MAX_SIZE]
+                        overridden = True
+                    if overridden:
+                        if code not in format_ids:
+                            format_ids[code] = next_format_id
+                            new_formats.append(
+                                f'<numFmt numFmtId="{next_format_id}" formatCode="{self.quote_attribute(code)}"/>'
+                            )
+                            next_format_id += 1
+                        xf.numFmtId = format_ids[code]
+                    item = xf
+                elements.append(tostring(item.to_tree()).decode('utf-8'))
+            styles_xml = self.append_style_items(styles_xml, list_tag, match, original_count, elements)
+
+        if new_formats:
+            match = re.search(r'<numFmts\b[^>]*?(?:/>|>(.*?)</numFmts>)', styles_xml, re.S)
+            if match:
+                styles_xml = self.append_style_items(styles_xml, 'numFmts', match, len(custom_formats), new_formats)
+            else:
+                # numFmts はスタイルシートの最初の要素
+                opening = re.search(r'<styleSheet\b[^>]*>', styles_xml)
+                styles_xml = (
+                    styles_xml[:opening.end()] + f'<numFmts count="{len(new_formats)}">'
+                    + ''.join(new_formats) + '</numFmts>' + styles_xml[opening.end():]
+                )
+        return styles_xml
+
+    def append_style_items(self, styles_xml, list_tag, match, original_count, elements):
+        """styles.xml の書式の一覧の末尾に要素を追記し、count を更新する"""
+        count_attribute = f'count="{original_count + len(elements)}"'
+        if match is None:
+            # dxfs がない場合は cellStyles（なければ cellXfs）の後に作成する
+            position = max(m.end() for m in re.finditer(r'</cellXfs>|</cellStyles>', styles_xml))
+            return styles_xml[:position] + f'<{list_tag} {count_attribute}>' + ''.join(elements) + f'</{list_tag}>' + styles_xml[position:]
+        opening = re.match(rf'<{list_tag}\b[^>]*?(?=/?>)', match.group(0)).group(0)
+        if re.search(r'\bcount=', opening):
+            opening = re.sub(r'\bcount=(["\'])\d*\1', count_attribute, opening)
+        else:
+            opening += f' {count_attribute}'
+        children = match.group(1) or ''
+        return (
+            styles_xml[:match.start()] + opening + '>' + children + ''.join(elements) + f'</{list_tag}>'
+            + styles_xml[match.end():]
+        )
+
+    def verify(self, output_path, copied_parts):
+        """
+        保存したファイルのパッケージの整合性を確認する
+        - コピーした元のパーツが元のファイルと同じ内容（CRC）であること
+        - リレーションシップの参照先と、コンテンツタイプの PartName がすべて存在すること
+        - workbook.xml のすべてのシートにリレーションシップがあること
+        元のファイルの時点ですでに参照先がないものは対象外とする
+        """
+        problems = []
+        with zipfile.ZipFile(self.source_path) as source, zipfile.ZipFile(output_path) as output:
+            infos = {info.filename: info for info in output.infolist()}
+            for info in source.infolist():
+                if info.filename in copied_parts and infos[info.filename].CRC != info.CRC:
+                    problems.append(f"{info.filename} の内容が元のファイルと異なります")
+
+            # 元のファイルにある参照（元から参照先がない参照を除外するために使用）
+            source_names = set(source.namelist())
+            source_references = set()
+            for name in source_names:
+                if name.endswith('.rels'):
+                    owner = self.get_rels_owner(name)
+                    for element, attributes in self.iter_relationships(source.read(name).decode('utf-8-sig')):
+                        if attributes.get('TargetMode') != 'External':
+                            source_references.add(self.resolve_target(owner, attributes['Target']))
+            source_overrides = {
+                unquote(self.parse_attributes(element).get('PartName', '')).lstrip('/')
+                for element in re.findall(
+                    r'<Override\b[^>]*/>', source.read(self.CONTENT_TYPES_PART).decode('utf-8-sig')
+                )
+            }
+            already_missing = (source_references | source_overrides) - source_names
+
+            workbook_rids = set()
+            for name in infos:
+                if not name.endswith('.rels'):
+                    continue
+                owner = self.get_rels_owner(name)
+                for element, attributes in self.iter_relationships(output.read(name).decode('utf-8-sig')):
+                    if owner == self.WORKBOOK_PART:
+                        workbook_rids.add(attributes['Id'])
+                    if attributes.get('TargetMode') == 'External':
+                        continue
+                    part = self.resolve_target(owner, attributes['Target'])
+                    if part not in infos and part not in already_missing:
+                        problems.append(f"{name} の参照先 {attributes['Target']} がありません")
+
+            content_types_xml = output.read(self.CONTENT_TYPES_PART).decode('utf-8-sig')
+            for element in re.findall(r'<Override\b[^>]*/>', content_types_xml):
+                part_name = unquote(self.parse_attributes(element)['PartName']).lstrip('/')
+                if part_name not in infos and part_name not in already_missing:
+                    problems.append(f"[Content_Types].xml の {part_name} がありません")
+
+            workbook_xml = output.read(self.WORKBOOK_PART).decode('utf-8-sig')
+            for element in re.findall(r'<sheet\b[^>]*/>', workbook_xml):
+                attributes = self.parse_attributes(element)
+                rid = next((value for key, value in attributes.items() if key.endswith(':id')), None)
+                if rid not in workbook_rids:
+                    problems.append(f"シート「{attributes['name']}」のリレーションシップがありません")
+
+        if problems:
+            raise Exception("追記モードで保存したファイルの整合性の確認に失敗しました:\n" + "\n".join(problems))
+
+
+class SheetValueReader:
+    """
+    シートのXMLを直接読み、各行の値のタプルを返す（読み取り専用の iter_rows(values_only=True) と同じ値）
+    openpyxl の読み取り専用シートはセルごとに値を解析するオブジェクトを作るため、大人数の取得データシートでは
+    読み込みの大半をこの処理が占める。ここではXMLの文字列から値を直接読み、書式・リッチテキストは読まない
+    （共有文字列・インライン文字列はふりがな（rPh）を除いたテキスト、日付の書式のセルは datetime / timedelta にする）
+    """
+
+    MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+    def __init__(self, file_path, sheet_name, epoch):
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.epoch = epoch
+
+    @classmethod
+    def read_text(cls, element):
+        """<si> / <is> / <r> のテキスト（<t> と書式付きの <r><t> をつなげたもの。ふりがなは含めない）"""
+        ns = cls.MAIN_NS
+        text = ''
+        runs = []
+        for child in element:
+            if child.tag == f'{ns}t':
+                text = child.text or ''  # <t> が複数ある場合は openpyxl と同じく最後のもの
+            elif child.tag == f'{ns}r':
+                runs.append(cls.read_text(child))
+        return text + ''.join(runs)
+
+    def read_shared_strings(self, archive, part_names):
+        """共有文字列の一覧を読み込む"""
+        rels_xml = archive.read(XlsmAppendWriter.WORKBOOK_RELS_PART).decode('utf-8-sig')
+        part = next((
+            XlsmAppendWriter.get_part_path(attributes['Target'])
+            for element, attributes in XlsmAppendWriter.iter_relationships(rels_xml)
+            if attributes.get('Type', '').endswith('/sharedStrings')
+        ), None)
+        strings = []
+        if part in part_names:
+            with archive.open(part) as f:
+                for event, element in ElementTree.iterparse(f):
+                    if element.tag == f'{self.MAIN_NS}si':
+                        strings.append(self.read_text(element))
+                        element.clear()
+        return strings
+
+    def read_date_styles(self, archive, part_names):
+        """日付・時間の書式のセルの書式番号（s 属性）を (日付, 時間) の集合として取得する"""
+        date_styles, timedelta_styles = set(), set()
+        if XlsmAppendWriter.STYLES_PART not in part_names:
+            return date_styles, timedelta_styles
+        root = ElementTree.fromstring(archive.read(XlsmAppendWriter.STYLES_PART))
+        ns = self.MAIN_NS
+        custom_formats = {
+            int(element.get('numFmtId')): element.get('formatCode')
+            for element in root.iterfind(f'{ns}numFmts/{ns}numFmt')
+        }
+        for index, xf in enumerate(root.iterfind(f'{ns}cellXfs/{ns}xf')):
+            format_id = int(xf.get('numFmtId', 0))
+            code = custom_formats.get(format_id) or builtin_format_code(format_id)
+            if is_date_format(code):
+                date_styles.add(index)
+            if is_timedelta_format(code):
+                timedelta_styles.add(index)
+        return date_styles, timedelta_styles
+
+    ROW_REF_PATTERN = re.compile(r'\br=["\'](\d+)["\']')
+    ENTITY_PATTERN = re.compile(r'&(?:#(\d+)|#x([0-9a-fA-F]+)|(amp|lt|gt|quot|apos));')
+    ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+    @classmethod
+    def unescape_text(cls, text):
+        """XMLのテキストの文字参照・改行を ElementTree と同じように戻す"""
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if '&' in text:
+            text = cls.ENTITY_PATTERN.sub(
+                lambda match: (
+                    chr(int(match.group(1))) if match.group(1)
+                    else chr(int(match.group(2), 16)) if match.group(2)
+                    else cls.ENTITIES[match.group(3)]
+                ),
+                text,
+            )
+        return text
+
+    def compile_patterns(self, prefix):
+        """
+        シートのXMLの名前空間の接頭辞（通常は空）に合わせて行・セルのパターンを作る
+        セルのパターンは、r・s・t 属性だけを持ち値（<v>）または1つの <t> だけのインライン文字列を含む
+        よく使われる形のセルを (列, s, t, 値, <is>, インライン文字列, '') として、
+        それ以外の形のセル（数式・書式付きの文字列・他の属性を持つセルなど）を ('', ..., セルのXML) として取り出す
+        """
+        p = re.escape(prefix)
+        self.row_end_tag = f'</{prefix}row>'
+        # 行の内容は </row> の手前まで（1文字ずつ比べないよう '<' の間をまとめて読む）
+        self.row_pattern = re.compile(rf'<{p}row\b([^>]*?)(?:/>|>([^<]*(?:<(?!/{p}row>)[^<]*)*)</{p}row>)')
+        self.cell_pattern = re.compile(
+            rf'<{p}c(?:\s+r="\$?([A-Z]+)\$?\d*")?(?:\s+s="(\d+)")?(?:\s+t="(\w+)")?\s*'
+            rf'(?:/>|>(?:<{p}v>([^<]*)</{p}v>|(<{p}is><{p}t(?:\s+xml:space="preserve")?>)([^<]*)</{p}t></{p}is>)</{p}c>)'
+            rf'|(<{p}c\b[^>]*?(?:/>|>.*?</{p}c>))',
+            re.S,
+        )
+
+    def iter_rows(self, min_row=1, block_size=1024 * 1024):
+        """
+        min_row 行目以降の各行の値のタプルを順に返す（行の幅は値または書式のある最後のセルまで、値のない行は空のタプル）
+        行・セルの位置は r 属性から取得し、r 属性がない場合は直前の行・セルの次の位置とする
+        ExcelReportGenerator.count_respondents と同じく block_size 文字ずつ読んで </row> までの行ごとに処理する
+        値だけのセル・1つの <t> だけのインライン文字列はXMLの文字列から直接読み、
+        それ以外のセル（数式・書式付きの文字列など）は ElementTree で解析する
+        """
+        with zipfile.ZipFile(self.file_path) as archive:
+            part_names = set(archive.namelist())
+            part = dict(XlsmAppendWriter.get_sheet_parts(archive)).get(self.sheet_name)
+            if part not in part_names:
+                raise Exception(f"「{self.sheet_name}」シートのデータが見つかりません")
+            self.shared_strings = self.read_shared_strings(archive, part_names)
+            self.date_styles, self.timedelta_styles = self.read_date_styles(archive, part_names)
+            self.shared_formulae = {}
+
+            next_row = min_row
+            row_num = 0
+            pending = ''
+            root_start = None
+            with archive.open(part) as f, io.TextIOWrapper(f, encoding='utf-8') as text:
+                while True:
+                    block = text.read(block_size)
+                    pending += block
+                    if root_start is None:
+                        # ルート要素の開始タグ（名前空間の宣言を含む）は、個別に解析するセルを囲むのに使う
+                        root_match = re.search(r'<(?:([\w.-]+):)?worksheet\b[^>]*>', pending)
+                        if not root_match:
+                            if not block:
+                                return
+                            continue
+                        prefix = f'{root_match.group(1)}:' if root_match.group(1) else ''
+                        root_start, root_end = root_match.group(0), f'</{prefix}worksheet>'
+                        self.compile_patterns(prefix)
+                    if block:
+                        # 途中で切れた行は次のブロックと合わせて処理する
+                        end = pending.rfind(self.row_end_tag)
+                        end = end + len(self.row_end_tag) if end >= 0 else 0
+                    else:
+                        end = len(pending)
+                    for row_match in self.row_pattern.finditer(pending, 0, end):
+                        ref = self.ROW_REF_PATTERN.search(row_match.group(1))
+                        row_num = int(ref.group(1)) if ref else row_num + 1
+                        if row_num < min_row:
+                            continue
+                        values = self.read_row(row_match.group(2) or '', root_start, root_end)
+
+                        # 値のない行（XMLに行がない行）は空のタプルとして返す
+                        while next_row < row_num:
+                            yield ()
+                            next_row += 1
+                        if next_row == row_num:
+                            yield tuple(values)
+                            next_row += 1
+                    pending = pending[end:]
+                    if not block:
+                        return
+
+    def read_row(self, row_xml, root_start, root_end):
+        """行のXMLから各セルの値のリストを作る（セルのない列は None）"""
+        values = []
+        col = 0
+        for column, style, data_type, value, inline_start, inline, cell_xml in self.cell_pattern.findall(row_xml):
+            if cell_xml:
+                # よく使われる形以外のセルは ElementTree で解析する（ルート要素の開始タグで名前空間を引き継ぐ）
+                cell = ElementTree.fromstring(root_start + cell_xml + root_end)[0]
+                ref = cell.get('r')
+                col = column_index_from_string(ref.rstrip('0123456789').strip('$').upper()) if ref else col + 1
+                value = self.read_value(cell)
+            else:
+                col = column_index_from_string(column) if column else col + 1
+                if inline_start:
+                    value = inline if data_type == 'inlineStr' else None
+                elif data_type == 'inlineStr':
+                    value = None
+                if value and ('&' in value or '\r' in value):
+                    value = self.unescape_text(value)
+                if not inline_start:
+                    value = self.convert_value(value, data_type or 'n', style)
+            if col == len(values) + 1:
+                values.append(value)
+            else:
+                if col > len(values):
+                    values.extend([None] * (col - len(values)))
+                values[col - 1] = value
+        return values
+
+    def read_value(self, cell):
+        """セルの値を取得（openpyxl の読み取り専用シートと同じ型にする）"""
+        ns = self.MAIN_NS
+        value = formula = inline = None
+        for child in cell:
+            if child.tag == f'{ns}v':
+                value = child.text
+            elif child.tag == f'{ns}f':
+                formula = child
+            elif child.tag == f'{ns}is':
+                inline = child
+        data_type = cell.get('t', 'n')
+        if formula is not None:
+            # 数式は値ではなく数式の文字列（共有数式は各セルの位置に合わせて変換する）
+            value = '=' + (formula.text or '')
+            formula_type = formula.get('t')
+            if formula_type == 'array':
+                return ArrayFormula(ref=formula.get('ref'), text=value)
+            if formula_type == 'shared':
+                index = formula.get('si')
+                if index in self.shared_formulae:
+                    return self.shared_formulae[index].translate_formula(cell.get('r'))
+                if value != '=':
+                    self.shared_formulae[index] = Translator(value, cell.get('r'))
+            return value
+        if data_type == 'inlineStr':
+            return self.read_text(inline) if inline is not None else None
+        return self.convert_value(value, data_type, cell.get('s'))
+
+    def convert_value(self, value, data_type, style):
+        """<v> のテキストを t 属性の型に合わせて変換する（style は s 属性の値）"""
+        if not value:
+            return None
+        if data_type == 'n':
+            value = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+            style = int(style or 0)
+            if style in self.date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return value
+        if data_type == 's':
+            return self.shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return from_ISO8601(value)
+        return value  # 'str'（数式の文字列の結果）・'e'（エラー）
 
 
 class ExcelReportGenerator:
@@ -24,12 +1363,23 @@ class ExcelReportGenerator:
         self.point_sheet = None
         self.template_sheet = None
         self.original_file_path = None  # 元のファイルパスを保存
+        self.original_sheets = []  # 読み込み時点のシート（追記モードで使用）
+        self.data_column_count = None  # 取得データシートの列数（読み取り専用の場合は受講者データの読み込み後に確定）
+        self.last_value_column = None  # 受講者の行で値が入っている最後の列（受講者データの読み込み時に取得）
+        self.sheet_registry = None  # 個別レポートのシート名の割り当て（ワークブックごとに1つ）
+        self.row_spools = []  # 受講者の行を一時ファイルに書き出している集計シート（追記モードで使用）
         
-    def load_workbook(self, file_path):
-        """Excelファイルを読み込む"""
+    def load_workbook(self, file_path, read_only=False):
+        """
+        Excelファイルを読み込む
+        read_only=True の場合、シートを読み取り専用でストリーミング読み込みする（結果ファイルのみ出力する場合・省メモリモードで使用）
+        """
         try:
-            self.wb = load_workbook(file_path, keep_vba=True)
+            self.wb = load_workbook(file_path, keep_vba=not read_only, read_only=read_only)
             self.original_file_path = file_path  # 元のファイルパスを保存
+            self.original_sheets = list(self.wb.worksheets) + list(self.wb.chartsheets)
+            self.last_value_column = None
+            self.sheet_registry = None
             return True
         except Exception as e:
             raise Exception(f"Excelファイルの読み込みに失敗しました: {str(e)}")
@@ -62,11 +1412,31 @@ class ExcelReportGenerator:
             raise Exception("「配点」シートが見つかりません")
         if not self.template_sheet:
             raise Exception("「Template」シートが見つかりません")
+        
+        if self.wb.read_only:
+            # 読み取り専用の読み込みではシートの範囲を <dimension> の記録だけで決めるため、
+            # 記録がない・古い（"A1" のままなど）場合でも全行を読めるよう範囲をリセットする
+            # 取得データの列数は受講者データの読み込み時に求める（範囲を求めるためだけに全行を読み直さない）
+            self.data_sheet.reset_dimensions()
+            self.point_sheet.reset_dimensions()
+            self.data_column_count = None
+        else:
+            self.data_column_count = self.data_sheet.max_column
     
     def get_answer_column(self):
         """回答列（Q列）を取得"""
         return 17  # Q列は17列目
     
+    def get_answer_columns(self):
+        """
+        回答を読み取る列番号のリスト（Q列から3列おき、最大GM列まで）を取得
+        取得データの列数が未確定（読み取り専用で読み込む前）の場合は、GM列までのすべての回答列を返す
+        """
+        last_answer_col = 195
+        if self.data_column_count is not None:
+            last_answer_col = min(last_answer_col, self.data_column_count)
+        return list(range(self.get_answer_column(), last_answer_col + 1, 3))
+    
     def read_point_data(self):
         """配点シートから配点データを読み込む＋分類・設問・総数取得"""
         # 配点シートの構造:
@@ -78,37 +1448,38 @@ class ExcelReportGenerator:
         sections = {}  # セクション別の情報
         section_names = []
         problems = []
-        row = 3  # ヘッダー行は2行目、データは3行目から
+        # ヘッダー行は2行目、データは3行目から（B～E列を行ごとにまとめて取得）
+        for row, row_values in enumerate(self.point_sheet.iter_rows(min_row=3, max_col=5, values_only=True), 3):
+            row_values = tuple(row_values) + (None,) * (5 - len(row_values))
 
-        while row <= self.point_sheet.max_row:
             # 問題番号を取得（D列）
-            question_num_cell = self.point_sheet.cell(row, 4)  # D列
-            if question_num_cell.value is None:
-                row += 1
+            question_num_value = row_values[3]
+            if question_num_value is None:
                 continue
 
             # セクション名を取得（B列）
-            section_cell = self.point_sheet.cell(row, 2)  # B列
-            section_name = str(section_cell.value).strip() if section_cell.value else ""
+            section_value = row_values[1]
+            section_name = str(section_value).strip() if section_value else ""
             if section_name and section_name not in section_names:
                 section_names.append(section_name)
 
             # 設問文を取得（C列）
-            problem_cell = self.point_sheet.cell(row, 3)  # C列
-            problem_text = str(problem_cell.value).strip() if problem_cell.value else ""
+            problem_value = row_values[2]
+            problem_text = str(problem_value).strip() if problem_value else ""
             problems.append(problem_text)
 
             # 配点を取得（E列）
-            point_cell = self.point_sheet.cell(row, 5)  # E列
-            if point_cell.value is not None:
-                question_num = int(question_num_cell.value)
-                point_value = float(point_cell.value)
+            point_value = row_values[4]
+            if point_value is not None:
+                question_num = int(question_num_value)
+                point_value = float(point_value)
 
                 points.append({
                     'question_num': question_num,
                     'section': section_name,
                     'point': point_value,
-                    'problem': problem_text
+                    'problem': problem_text,
+                    'row': row
                 })
 
                 # セクション別の集計用
@@ -117,8 +1488,6 @@ class ExcelReportGenerator:
                 sections[section_name]['total_points'] += point_value
                 sections[section_name]['questions'].append(question_num)
 
-            row += 1
-
         # 問題番号順にソート
         points.sort(key=lambda x: x['question_num'])
 
@@ -126,44 +1495,78 @@ class ExcelReportGenerator:
         return points, sections, section_names, problems, total_problems
     
     
-    def read_student_data(self, points_data, sections_data):
-        """取得データシートから受講者データを読み込む（各問題ごとの得点を計算）"""
+    def iter_data_sheet_rows(self):
+        """
+        取得データシートの各行の値のタプルを1行目から順に返す
+        読み取り専用で読み込んだ場合は、openpyxl のシートではなく SheetValueReader でシートのXMLを直接読む
+        """
+        if self.wb.read_only and self.original_file_path is not None:
+            reader = SheetValueReader(self.original_file_path, self.data_sheet.title, self.wb.epoch)
+            return reader.iter_rows()
+        return self.data_sheet.iter_rows(values_only=True)
+    
+    def iter_student_rows(self, anomalies=None):
+        """
+        取得データシートを1行ずつ読み込み、(行番号, 氏名, メールアドレス, 回答リスト) を順に返す
+        セル単位のアクセスではなく行をまとめて取得する（iter_data_sheet_rows を参照）
+        anomalies にリストを指定した場合、0/1以外の回答（0として扱う）をセル位置とともに追加する
+        読み込み終了後、受講者の行で値が入っている最後の列を last_value_column に設定する
+        """
         # 取得データシートの構造:
         # L列（12列目）: 氏名
         # M列（13列目）: メールアドレス
         # Q列（17列目）から: 回答データ（0=不正解、1=正解）
-        students = []
-        answer_col = self.get_answer_column()  # Q列 = 17列目
+        answer_cols = self.get_answer_columns()
+
+        # 取得データの列数が未確定（読み取り専用）の場合は、読み込んだ各行（ヘッダー行を含む）の幅から求める
+        column_count = None if self.data_column_count is not None else 0
 
         # ヘッダー行は1行目、データは2行目から
         data_start_row = 2
+        last_value_column = 0
+
+        for row, values in enumerate(self.iter_data_sheet_rows(), 1):
+            if column_count is not None:
+                column_count = max(column_count, len(values))
+            if row < data_start_row:
+                continue
 
-        for row in range(data_start_row, self.data_sheet.max_row + 1):
             # 氏名を取得（L列 = 12列目）
-            name_cell = self.data_sheet.cell(row, 12)
-            if name_cell.value is None:
+            name_value = values[11] if len(values) > 11 else None
+            if name_value is None:
                 continue
+            email_value = values[12] if len(values) > 12 else None
+
+            # 値が入っている最後の列（これまでの行より右側だけを確認する）
+            for col in range(len(values), last_value_column, -1):
+                value = values[col - 1]
+                if value is not None and str(value).strip() != '':
+                    last_value_column = col
+                    break
 
-            # 回答データを取得（Q列から）
+            # 回答データを取得（Q列から3列おき）
             answers = []
-            col = answer_col  # Q列 = 17列目
-            while col <= min(195, self.data_sheet.max_column):
+            for col in answer_cols:
                 # 回答は answer_col または answer_col+1 にある場合がある
-                answer_cell_1 = self.data_sheet.cell(row, col)
-                answer_cell_2 = self.data_sheet.cell(row, col + 1)
+                value_1 = values[col - 1] if col - 1 < len(values) else None
+                value_2 = values[col] if col < len(values) else None
 
                 # どちらかに値があれば優先して取得
                 answer_value = None
-                if answer_cell_1.value is not None and str(answer_cell_1.value).strip() != '':
+                answer_cell_col = None
+                raw_value = None
+                if value_1 is not None and str(value_1).strip() != '':
+                    answer_cell_col, raw_value = col, value_1
                     try:
-                        answer_value = int(answer_cell_1.value)
+                        answer_value = int(value_1)
                     except (ValueError, TypeError):
-                        answer_value = 0
-                elif answer_cell_2.value is not None and str(answer_cell_2.value).strip() != '':
+                        answer_value = None
+                elif value_2 is not None and str(value_2).strip() != '':
+                    answer_cell_col, raw_value = col + 1, value_2
                     try:
-                        answer_value = int(answer_cell_2.value)
+                        answer_value = int(value_2)
                     except (ValueError, TypeError):
-                        answer_value = 0
+                        answer_value = None
                 else:
                     answer_value = 0
 
@@ -172,9 +1575,30 @@ class ExcelReportGenerator:
                     answers.append(answer_value)
                 else:
                     answers.append(0)
+                    if anomalies is not None:
+                        anomalies.append({
+                            'sheet': self.data_sheet.title,
+                            'cell': f"{get_column_letter(answer_cell_col)}{row}",
+                            'message': f"回答 {raw_value!r} は0/1ではないため0（不正解）として扱います",
+                        })
 
-                col += 3
+            yield row, str(name_value).strip(), str(email_value).strip() if email_value else "", answers
 
+        if column_count is not None:
+            self.data_column_count = column_count
+        self.last_value_column = last_value_column
+
+    def read_student_data(self, points_data, sections_data, answer_matrix=None, anomalies=None):
+        """
+        取得データシートから受講者データを読み込む（各問題ごとの得点を計算）
+        answer_matrix を指定した場合、回答はメモリ上のリストではなく AnswerMatrix に書き出し、
+        各受講者の 'answers' には AnswerMatrix の行ビューを設定する
+        （受講者データは辞書のリストではなく RecordTable に保持する）
+        anomalies にリストを指定した場合、0/1以外の回答をセル位置とともに追加する
+        """
+        students = [] if answer_matrix is None else RecordTable()
+
+        for row, name, email, answers in self.iter_student_rows(anomalies=anomalies):
             # 各セクションの得点を計算
             section_scores = {section: 0 for section in sections_data.keys()}
             total_score = 0
@@ -187,107 +1611,144 @@ class ExcelReportGenerator:
                     section_scores[section_name] += point_value
                     total_score += point_value
 
+            if answer_matrix is not None:
+                answer_matrix.append(answers)
+                answers = None
+
             students.append({
-                'name': str(name_cell.value).strip(),
+                'name': name,
+                'email': email,
                 'section_scores': section_scores,
                 'total_score': total_score,
                 'answers': answers,  # ← これを追加
                 'row': row
             })
 
+        # 読み取り専用の読み込みでは列数がここで確定するため、回答は実際の回答列の数までにする
+        answer_count = len(self.get_answer_columns())
+        if answer_matrix is not None:
+            answer_matrix.finalize(question_count=answer_count)
+            for index, student in enumerate(students):
+                student['answers'] = answer_matrix.row(index)
+        else:
+            for student in students:
+                del student['answers'][answer_count:]
+
         return students
     
-    def calculate_scores(self, students, points_data, sections_data):
-        """各受講者の得点を計算"""
+    def calculate_scores(self, students, points_data, sections_data, answer_matrix=None, chunk_size=1000):
+        """
+        各受講者の得点を計算
+        answer_matrix を指定した場合、回答は chunk_size 人ずつ AnswerMatrix から復元して採点し、
+        結果は辞書のリストではなく RecordTable に保持する
+        """
         # points_data: 問題番号順にソートされた配点データのリスト
         # sections_data: セクション別の情報
-        results = []
+        if answer_matrix is None:
+            return [
+                self.score_student(student, student['answers'], points_data, sections_data)
+                for student in students
+            ]
         
-        for student in students:
-            answers = student['answers']
-            total_score = 0
-            max_score = 0
-            section_scores = {}  # セクション別の得点と正解数
+        results = RecordTable()
+        for start, chunk in answer_matrix.iter_chunks(chunk_size):
+            for student, answers in zip(students[start:start + len(chunk)], chunk):
+                # 問題ごとの採点結果は保持せず、参照した時に AnswerMatrix の回答から作る
+                results.append(
+                    self.score_student(student, answers, points_data, sections_data, keep_question_scores=False)
+                )
+        
+        return results
+    
+    def score_student(self, student, answers, points_data, sections_data, keep_question_scores=True):
+        """
+        1受講者の得点を計算
+        keep_question_scores=False の場合、問題ごとの採点結果はリストを作らず、
+        student['answers'] から参照時に作る QuestionScores にする
+        """
+        total_score = 0
+        max_score = 0
+        section_scores = {}  # セクション別の得点と正解数
+        
+        # セクション別の集計を初期化
+        for section_name in sections_data.keys():
+            section_scores[section_name] = {
+                'score': 0,  # 配点を考慮した得点
+                'max_score': sections_data[section_name]['total_points'],  # セクションの満点
+                'correct_count': 0,  # 正解した問題数
+                'total_questions': 0  # セクションの問題数
+            }
+        
+        # セクション別の問題数をカウント
+        for point_info in points_data:
+            section_name = point_info['section']
+            if section_name in section_scores:
+                section_scores[section_name]['total_questions'] += 1
+        
+        # 配点データと回答を照合
+        question_scores = [] if keep_question_scores else QuestionScores(student['answers'], points_data)
+        
+        for i, point_info in enumerate(points_data):
+            question_num = point_info['question_num']
+            section_name = point_info['section']
+            point_value = point_info['point']
             
-            # セクション別の集計を初期化
-            for section_name in sections_data.keys():
-                section_scores[section_name] = {
-                    'score': 0,  # 配点を考慮した得点
-                    'max_score': sections_data[section_name]['total_points'],  # セクションの満点
-                    'correct_count': 0,  # 正解した問題数
-                    'total_questions': 0  # セクションの問題数
-                }
-            
-            # セクション別の問題数をカウント
-            for point_info in points_data:
-                section_name = point_info['section']
-                if section_name in section_scores:
-                    section_scores[section_name]['total_questions'] += 1
+            max_score += point_value
             
-            # 配点データと回答を照合
-            question_scores = []
+            # 回答を取得（問題番号は1から始まるので、インデックスはquestion_num-1）
+            # 回答データはQ列から3列おきに取得されているため、問題番号順に対応
+            if question_num - 1 < len(answers):
+                answer = answers[question_num - 1]
+            else:
+                answer = 0  # 回答がない場合は0（不正解）
             
-            for i, point_info in enumerate(points_data):
-                question_num = point_info['question_num']
-                section_name = point_info['section']
-                point_value = point_info['point']
-                
-                max_score += point_value
-                
-                # 回答を取得（問題番号は1から始まるので、インデックスはquestion_num-1）
-                # 回答データはQ列から3列おきに取得されているため、問題番号順に対応
-                if question_num - 1 < len(answers):
-                    answer = answers[question_num - 1]
-                else:
-                    answer = 0  # 回答がない場合は0（不正解）
-                
-                if answer == 1:  # 正解
-                    total_score += point_value
-                    section_scores[section_name]['score'] += point_value
-                    section_scores[section_name]['correct_count'] += 1
+            if answer == 1:  # 正解
+                total_score += point_value
+                section_scores[section_name]['score'] += point_value
+                section_scores[section_name]['correct_count'] += 1
+                if keep_question_scores:
                     question_scores.append({
                         'question_num': question_num,
                         'section': section_name,
                         'point': point_value,
                         'correct': True
                     })
-                else:  # 不正解
-                    question_scores.append({
-                        'question_num': question_num,
-                        'section': section_name,
-                        'point': point_value,
-                        'correct': False
-                    })
-            
-            # 5点評価を計算（100点満点として）
-            if max_score > 0:
-                percentage = (total_score / max_score) * 100
-                if percentage >= 90:
-                    rating = 5
-                elif percentage >= 80:
-                    rating = 4
-                elif percentage >= 70:
-                    rating = 3
-                elif percentage >= 60:
-                    rating = 2
-                else:
-                    rating = 1
+            elif keep_question_scores:  # 不正解
+                question_scores.append({
+                    'question_num': question_num,
+                    'section': section_name,
+                    'point': point_value,
+                    'correct': False
+                })
+        
+        # 5点評価を計算（100点満点として）
+        if max_score > 0:
+            percentage = (total_score / max_score) * 100
+            if percentage >= 90:
+                rating = 5
+            elif percentage >= 80:
+                rating = 4
+            elif percentage >= 70:
+                rating = 3
+            elif percentage >= 60:
+                rating = 2
             else:
-                rating = 0
-                percentage = 0
-            
-            results.append({
-                'name': student['name'],
-                'total_score': total_score,
-                'max_score': max_score,
-                'percentage': percentage,
-                'rating': rating,
-                'section_scores': section_scores,
-                'question_scores': question_scores,
-                'answers': answers
-            })
+                rating = 1
+        else:
+            rating = 0
+            percentage = 0
         
-        return results
+        return {
+            'name': student['name'],
+            'email': student.get('email', ''),
+            'total_score': total_score,
+            'max_score': max_score,
+            'percentage': percentage,
+            'rating': rating,
+            'section_scores': section_scores,
+            'question_scores': question_scores,
+            'answers': student['answers']
+        }
     
     def calculate_company_averages(self, results, sections_data):
         """全受講者の平均値を計算（5点評価）"""
@@ -307,6 +1768,46 @@ class ExcelReportGenerator:
         
         return company_avg
     
+    def calculate_cohort_standings(self, results, sections_data):
+        """
+        全受講者の中での順位・パーセンタイルを計算し、各結果に追加する
+        得点を一度だけソートし、二分探索で位置を求める（受講者同士の総当たり比較はしない）
+        - rank: 総合得点の順位（同点は同順位）
+        - percentile: 総合得点がその受講者以下である受講者の割合（%）
+        - section_percentiles: セクション別得点のパーセンタイル（%）
+        """
+        count = len(results)
+        if count == 0:
+            return results
+        
+        sorted_totals = sorted(result['total_score'] for result in results)
+        sorted_sections = {
+            section_name: sorted(
+                result['section_scores'].get(section_name, {'score': 0})['score'] for result in results
+            )
+            for section_name in sections_data.keys()
+        }
+        
+        for result in results:
+            # 自分以下の人数（ソート済み配列上の右端位置）
+            at_or_below = bisect.bisect_right(sorted_totals, result['total_score'])
+            result['rank'] = count - at_or_below + 1
+            result['percentile'] = round(at_or_below / count * 100, 1)
+            
+            section_percentiles = {}
+            for section_name, sorted_scores in sorted_sections.items():
+                score = result['section_scores'].get(section_name, {'score': 0})['score']
+                section_percentiles[section_name] = round(
+                    bisect.bisect_right(sorted_scores, score) / count * 100, 1
+                )
+            result['section_percentiles'] = section_percentiles
+        
+        return results
+    
+    def average(self, values):
+        """平均値を計算（ExcelのAVERAGE関数の代わりに値を書き込む場合に使用）"""
+        return sum(values) / len(values) if values else 0
+    
     def create_radar_chart(self, sheet, section_names, data_start_row=27, chart_position="B8"):
         """テーブルデータからレーダーチャートを作成"""
         try:
@@ -346,23 +1847,74 @@ class ExcelReportGenerator:
             traceback.print_exc()
             pass
     
-    def create_report_sheet(self, result, template_sheet_name, student_row_index, all_results=None, sections_data=None):
+    def get_star_symbols(self, rating):
+        """総合点から星レビュー（F4～J4）の表示文字を計算（数式と同じ判定）"""
+        # F4: 1つ目の星は E4>=1 なら★、それ以外は☆
+        # G4～J4: n つ目の星は E4>=n なら★、n-1<=E4<n なら◐、それ以外は☆
+        symbols = ['★' if rating >= 1 else '☆']
+        for n in range(2, 6):
+            if rating >= n:
+                symbols.append('★')
+            elif n - 1 <= rating < n:
+                symbols.append('◐')
+            else:
+                symbols.append('☆')
+        return symbols
+    
+    def get_sheet_registry(self, template_sheet_name=None):
+        """
+        個別レポートのシート名を割り当てる SheetNameRegistry を取得
+        ワークブックごとに1つだけ作成し、既存のシート名は作成時に一度だけ取得する
+        """
+        if self.sheet_registry is None:
+            reserved_names = [
+                sheet.title for sheet in (self.data_sheet, self.point_sheet, self.template_sheet) if sheet is not None
+            ]
+            if template_sheet_name:
+                reserved_names.append(template_sheet_name)
+            self.sheet_registry = SheetNameRegistry(
+                self.wb.sheetnames, reserved_names=reserved_names + ["総合得点", "5点評価", "集計スコア"]
+            )
+        return self.sheet_registry
+    
+    def create_named_sheet(self, sheet_name):
+        """
+        SheetNameRegistry で割り当てた（重複しないことが確定した）シート名で空のシートを追加する
+        openpyxl の create_sheet はそのたびに全シート名の一覧を作って重複を確認するため、シート数に比例する処理が
+        発生する（分けて書き込む場合は、書き込んだシートをワークブックから取り除くため、確認するのは一度に作成する分のみ）
+        """
+        sheet = self.wb.create_sheet(title=sheet_name)
+        if sheet.title != sheet_name:
+            raise Exception(f"シート名「{sheet_name}」が既存のシートと重複しています")
+        return sheet
+    
+    def create_report_sheet(self, result, template_sheet_name, student_row_index, all_results=None, sections_data=None, use_formulas=True, company_avg=None, sheet_registry=None):
         """
         個別レポートシートを作成（テンプレートをそのままコピーし、氏名と得点のみ埋める）
         グラフや星などテンプレートの内容はそのまま残す
+        use_formulas=False の場合、星レビューは数式ではなく計算済みの値で書き込む
+        シート名は sheet_registry（省略時はワークブックごとの SheetNameRegistry）で割り当てる
         """
-        template = self.wb[template_sheet_name]
-        # シート名を学生の名前に設定（Excelのシート名は31文字まで）
-        new_sheet_name = result['name']
-        if len(new_sheet_name) > 31:
-            new_sheet_name = new_sheet_name[:31]
-        # 既存のシートがあれば削除
-        if new_sheet_name in self.wb.sheetnames:
-            self.wb.remove(self.wb[new_sheet_name])
-        # テンプレートシートをコピー（チャートや星レビューも含む）
-        # copy_worksheet はチャート、図形、VBAマクロ、条件付き書式などを含むすべての要素をコピーします
-        new_sheet = self.wb.copy_worksheet(template)
-        new_sheet.title = new_sheet_name
+        if self.template_sheet is not None and self.template_sheet.title == template_sheet_name:
+            template = self.template_sheet
+        else:
+            template = self.wb[template_sheet_name]
+        # シート名を学生の名前に設定（Excelのシート名規則を適用し、重複時は一意な名前にする）
+        if sheet_registry is None:
+            sheet_registry = self.get_sheet_registry(template_sheet_name)
+        new_sheet_name, replaced_sheet_name = sheet_registry.register(result['name'], result.get('email', ''))
+        result['sheet_name'] = new_sheet_name
+        # 同名の既存シート（前回の出力など）があれば削除
+        if replaced_sheet_name is not None:
+            self.wb.remove(self.wb[replaced_sheet_name])
+        # テンプレートシートをコピー（セルの値・書式、結合セル、列幅、ページ設定など）
+        # 仮の名前でコピーしてから名前を変更せず、割り当てたシート名のシートに直接コピーする
+        new_sheet = self.create_named_sheet(new_sheet_name)
+        WorksheetCopy(source_worksheet=template, target_worksheet=new_sheet).copy_worksheet()
+        # 印刷範囲・印刷タイトルは WorksheetCopy でコピーされないため、テンプレートから引き継ぐ
+        new_sheet.print_area = template.print_area
+        new_sheet.print_title_rows = template.print_title_rows
+        new_sheet.print_title_cols = template.print_title_cols
         
         # 重要: 星レビューの視覚的表示には、テンプレートシートに以下の設定が必要です：
         # 1. セルF4:J4を選択
@@ -389,9 +1941,19 @@ class ExcelReportGenerator:
         }
         
         # 社内平均を計算（全受講者の平均値）
-        company_avg = {}
-        if all_results and sections_data:
-            company_avg = self.calculate_company_averages(all_results, sections_data)
+        # 呼び出し側で計算済みの場合はそれを使う（シートごとの再計算を避ける）
+        if company_avg is None:
+            company_avg = {}
+            if all_results and sections_data:
+                company_avg = self.calculate_company_averages(all_results, sections_data)
+        
+        # セクション別パーセンタイルの見出し（E26）
+        section_percentiles = result.get('section_percentiles')
+        if section_percentiles is not None:
+            try:
+                new_sheet['E26'] = 'パーセンタイル'
+            except Exception:
+                pass
         
         for idx, section_name in enumerate(section_names):
             if idx in section_row_mapping:
@@ -420,6 +1982,15 @@ class ExcelReportGenerator:
                     new_sheet.cell(row, 4).value = section_value
                 except Exception:
                     pass
+                
+                # セクション別パーセンタイルをE列に設定
+                if section_percentiles is not None and section_name in section_percentiles:
+                    try:
+                        cell = new_sheet.cell(row, 5)
+                        cell.value = section_percentiles[section_name]
+                        cell.number_format = '0.0'
+                    except Exception:
+                        pass
 
         # 総合点（E4セル）を埋める（例: 5点評価の平均値）
         try:
@@ -442,25 +2013,31 @@ class ExcelReportGenerator:
                 # - 小数部分がある場合、次の星を半分として表示（左半分塗りつぶしの星）
                 # - 半分の星はUnicodeの左半分円（◐）または視覚的に半分に見える文字を使用
                 
-                # F4: 1つ目の星（E4>=1なら★、それ以外は☆）
-                new_sheet['F4'] = '=IF(E4>=1,"★","☆")'
-                
-                # G4: 2つ目の星（E4>=2なら★、E4>=1かつE4<2なら半分★、それ以外は☆）
-                # 半分の星には左半分が塗りつぶされた円（◐）または視覚的に半分に見える文字を使用
-                # 実際には、条件付き書式で半分の星を表示する方が良いが、数式でも可能
-                new_sheet['G4'] = '=IF(E4>=2,"★",IF(AND(E4>=1,E4<2),"◐","☆"))'
-                
-                # H4: 3つ目の星（E4>=3なら★、E4>=2かつE4<3なら半分★、それ以外は☆）
-                new_sheet['H4'] = '=IF(E4>=3,"★",IF(AND(E4>=2,E4<3),"◐","☆"))'
-                
-                # I4: 4つ目の星（E4>=4なら★、E4>=3かつE4<4なら半分★、それ以外は☆）
-                new_sheet['I4'] = '=IF(E4>=4,"★",IF(AND(E4>=3,E4<4),"◐","☆"))'
-                
-                # J4: 5つ目の星（E4>=5なら★、E4>=4かつE4<5なら半分★、それ以外は☆）
-                new_sheet['J4'] = '=IF(E4>=5,"★",IF(AND(E4>=4,E4<5),"◐","☆"))'
+                star_cells = ['F4', 'G4', 'H4', 'I4', 'J4']
+                if use_formulas:
+                    # F4: 1つ目の星（E4>=1なら★、それ以外は☆）
+                    new_sheet['F4'] = '=IF(E4>=1,"★","☆")'
+                    
+                    # G4: 2つ目の星（E4>=2なら★、E4>=1かつE4<2なら半分★、それ以外は☆）
+                    # 半分の星には左半分が塗りつぶされた円（◐）または視覚的に半分に見える文字を使用
+                    # 実際には、条件付き書式で半分の星を表示する方が良いが、数式でも可能
+                    new_sheet['G4'] = '=IF(E4>=2,"★",IF(AND(E4>=1,E4<2),"◐","☆"))'
+                    
+                    # H4: 3つ目の星（E4>=3なら★、E4>=2かつE4<3なら半分★、それ以外は☆）
+                    new_sheet['H4'] = '=IF(E4>=3,"★",IF(AND(E4>=2,E4<3),"◐","☆"))'
+                    
+                    # I4: 4つ目の星（E4>=4なら★、E4>=3かつE4<4なら半分★、それ以外は☆）
+                    new_sheet['I4'] = '=IF(E4>=4,"★",IF(AND(E4>=3,E4<4),"◐","☆"))'
+                    
+                    # J4: 5つ目の星（E4>=5なら★、E4>=4かつE4<5なら半分★、それ以外は☆）
+                    new_sheet['J4'] = '=IF(E4>=5,"★",IF(AND(E4>=4,E4<5),"◐","☆"))'
+                else:
+                    # 数式を使わず、E4と同じ値から計算した星をそのまま書き込む
+                    # （Excelでの再計算が不要になり、キャッシュ値のないビューアでも表示される）
+                    for cell_ref, symbol in zip(star_cells, self.get_star_symbols(avg_rating)):
+                        new_sheet[cell_ref] = symbol
                 
                 # フォントスタイルを設定して星を見やすくする
-                star_cells = ['F4', 'G4', 'H4', 'I4', 'J4']
                 try:
                     for cell_ref in star_cells:
                         cell = new_sheet[cell_ref]
@@ -484,6 +2061,17 @@ class ExcelReportGenerator:
         except Exception:
             pass
 
+        # 順位（K4）とパーセンタイル（L4）を総合点の横に埋める
+        if 'rank' in result:
+            try:
+                new_sheet['K3'] = '順位'
+                new_sheet['K4'] = result['rank']
+                new_sheet['L3'] = 'パーセンタイル'
+                new_sheet['L4'] = result['percentile']
+                new_sheet['L4'].number_format = '0.0'
+            except Exception:
+                pass
+
         # レーダーチャートを作成（テーブルデータを基に）
         try:
             self.create_radar_chart(new_sheet, section_names, data_start_row=27, chart_position="B8")
@@ -499,8 +2087,28 @@ class ExcelReportGenerator:
 
         return new_sheet
     
-    def create_summary_sheet(self, results, sections_data, points_data):
-        """集計シートを作成（分類別得点を正確に集計）"""
+    def spool_sheet_rows(self, sheet, first_row, spool_rows):
+        """
+        spool_rows を指定した場合、sheet の first_row 行目以降を spool_rows 行ごとに一時ファイルへ書き出す SheetRowSpool を返す
+        （追記モードで保存する場合のみ。書き出した行は保存時に XlsmAppendWriter が挿入する）
+        """
+        if not spool_rows:
+            return None
+        spool = SheetRowSpool(sheet, first_row, spool_rows)
+        self.row_spools.append(spool)
+        return spool
+    
+    def close_row_spools(self):
+        """SheetRowSpool の一時ファイルを閉じる"""
+        for spool in self.row_spools:
+            spool.close()
+        self.row_spools = []
+    
+    def create_summary_sheet(self, results, sections_data, points_data, use_formulas=True, spool_rows=None):
+        """
+        集計シートを作成（分類別得点を正確に集計）
+        spool_rows を指定した場合、受講者の行は spool_rows 行ごとに一時ファイルへ書き出す（spool_sheet_rows を参照）
+        """
         summary_name = "総合得点"
         if summary_name in self.wb.sheetnames:
             self.wb.remove(self.wb[summary_name])
@@ -532,6 +2140,10 @@ class ExcelReportGenerator:
             bottom=Side(style='thin')
         )
 
+        # 列ごとの値（平均行を値で書き込む場合に使用）
+        column_values = {col: array('d') for col in range(2, len(headers) + 1)}
+        spool = self.spool_sheet_rows(summary_sheet, 3, spool_rows)
+
         # データ行
         for row_idx, result in enumerate(results, 3):
             summary_sheet.cell(row_idx, 1).value = result['name']
@@ -552,13 +2164,19 @@ class ExcelReportGenerator:
                 cell = summary_sheet.cell(row_idx, col_idx)
                 cell.value = section_score
                 cell.border = thin_border
+                column_values[col_idx].append(section_score)
                 total_score += section_score
                 col_idx += 1
             max_score = sum([pt['point'] for pt in points_data])
             total_cell = summary_sheet.cell(row_idx, col_idx)
             total_cell.value = int(total_score)
+            column_values[col_idx].append(int(total_score))
             total_cell.border = thin_border
             total_cell.alignment = Alignment(horizontal='right')
+            if spool:
+                spool.row_written(row_idx)
+        if spool:
+            spool.flush()
 
         # 平均行の追加
         avg_row_idx = len(results) + 3
@@ -567,11 +2185,13 @@ class ExcelReportGenerator:
         summary_sheet.cell(avg_row_idx, 1).border = thin_border
 
         for col in range(2, len(headers) + 1):
-            col_letter = get_column_letter(col)
-            # 3行目からデータが始まる
-            formula = f"=AVERAGE({col_letter}3:{col_letter}{avg_row_idx-1})"
             cell = summary_sheet.cell(avg_row_idx, col)
-            cell.value = formula
+            if use_formulas:
+                col_letter = get_column_letter(col)
+                # 3行目からデータが始まる
+                cell.value = f"=AVERAGE({col_letter}3:{col_letter}{avg_row_idx-1})"
+            else:
+                cell.value = self.average(column_values[col])
             cell.border = thin_border
             cell.font = openpyxl.styles.Font(bold=True)
             cell.alignment = Alignment(horizontal='right')
@@ -583,8 +2203,11 @@ class ExcelReportGenerator:
             cell.border = thin_border
             summary_sheet.column_dimensions[get_column_letter(col)].width = 20
     
-    def create_rating_sheet(self, results, sections_data):
-        """5点評価シートを作成（各セクションごとに5点評価を表示・集計）"""
+    def create_rating_sheet(self, results, sections_data, use_formulas=True, spool_rows=None):
+        """
+        5点評価シートを作成（各セクションごとに5点評価を表示・集計）
+        spool_rows を指定した場合、受講者の行は spool_rows 行ごとに一時ファイルへ書き出す（spool_sheet_rows を参照）
+        """
         rating_name = "5点評価"
         if rating_name in self.wb.sheetnames:
             self.wb.remove(self.wb[rating_name])
@@ -614,6 +2237,24 @@ class ExcelReportGenerator:
                 cell.fill = fill
             rating_sheet.column_dimensions[get_column_letter(col)].width = 20
 
+        # 順位・パーセンタイル列（平均行の対象外）
+        standing_headers = ['順位', 'パーセンタイル'] + [
+            f'{section_name}（パーセンタイル）' for section_name in sections_data.keys()
+        ]
+        has_standings = bool(results) and 'rank' in results[0]
+        if has_standings:
+            for offset, header in enumerate(standing_headers):
+                col = len(headers) + 1 + offset
+                cell = rating_sheet.cell(2, col)
+                cell.value = header
+                cell.font = openpyxl.styles.Font(bold=True)
+                cell.border = thin_border
+                rating_sheet.column_dimensions[get_column_letter(col)].width = 20
+
+        # 列ごとの値（平均行を値で書き込む場合に使用）
+        column_values = {col: array('d') for col in range(2, len(headers) + 1)}
+        spool = self.spool_sheet_rows(rating_sheet, 3, spool_rows)
+
         # データ行
         for row_idx, result in enumerate(results, 3):
             rating_sheet.cell(row_idx, 1).value = result['name']
@@ -632,6 +2273,7 @@ class ExcelReportGenerator:
                 cell.border = thin_border
                 cell.alignment = Alignment(horizontal='right')
                 cell.number_format = '0.00'
+                column_values[col_idx].append(section_value)
                 total_rating += section_value
                 col_idx += 1
             # 総合評価（5点満点）の平均
@@ -640,7 +2282,24 @@ class ExcelReportGenerator:
             total_cell.value = avg_rating
             total_cell.border = thin_border
             total_cell.number_format = '0.00'
+            column_values[col_idx].append(avg_rating)
+
+            if has_standings:
+                standing_values = [result['rank'], result['percentile']] + [
+                    result['section_percentiles'].get(section_name, 0) for section_name in sections_data.keys()
+                ]
+                for offset, value in enumerate(standing_values):
+                    cell = rating_sheet.cell(row_idx, col_idx + 1 + offset)
+                    cell.value = value
+                    cell.border = thin_border
+                    cell.alignment = Alignment(horizontal='right')
+                    if offset > 0:
+                        cell.number_format = '0.0'
             total_cell.alignment = Alignment(horizontal='right')
+            if spool:
+                spool.row_written(row_idx)
+        if spool:
+            spool.flush()
 
         # 平均行の追加
         avg_row_idx = len(results) + 3
@@ -649,24 +2308,38 @@ class ExcelReportGenerator:
         rating_sheet.cell(avg_row_idx, 1).border = thin_border
 
         for col in range(2, len(headers) + 1):
-            col_letter = get_column_letter(col)
-            formula = f"=AVERAGE({col_letter}3:{col_letter}{avg_row_idx-1})"
             cell = rating_sheet.cell(avg_row_idx, col)
-            cell.value = formula
+            if use_formulas:
+                col_letter = get_column_letter(col)
+                cell.value = f"=AVERAGE({col_letter}3:{col_letter}{avg_row_idx-1})"
+            else:
+                cell.value = self.average(column_values[col])
             cell.border = thin_border
             cell.font = openpyxl.styles.Font(bold=True)
             cell.alignment = Alignment(horizontal='right')
             cell.number_format = '0.00'
     
+    def get_last_data_column(self, sheet, header_row=1, data_rows=()):
+        """ヘッダー行と data_rows の各行で値が入っている最後の列番号を取得（書式だけの列は含めない）"""
+        last_col = 0
+        for row_num in (header_row, *data_rows):
+            for row in sheet.iter_rows(min_row=row_num, max_row=row_num, values_only=True):
+                for col, value in enumerate(row, 1):
+                    if value is not None and str(value).strip() != '':
+                        last_col = max(last_col, col)
+        return last_col
+    
     def update_data_sheet(self, students, results, sections_data):
         """取得データシートに各問題類型のスコア列を追加"""
-        # 学生の行番号と結果を対応付ける辞書を作成
-        student_row_to_result = {}
-        for student, result in zip(students, results):
-            student_row_to_result[student['row']] = result
-        
-        # 最後の列を取得
-        last_col = self.data_sheet.max_column
+        # 最後のデータ列を取得（max_column は書式だけの列を含むため使わない）
+        # ヘッダーのない列に受講者の値がある場合も上書きしないよう、受講者の行の最後の列も含める
+        # （受講者データの読み込み時に取得済みであればそれを使い、なければ受講者の行を確認する）
+        if self.last_value_column is not None:
+            last_col = max(self.get_last_data_column(self.data_sheet), self.last_value_column)
+        else:
+            last_col = self.get_last_data_column(
+                self.data_sheet, data_rows=[student['row'] for student in students]
+            )
         start_col = last_col + 2  # 1列空けてから追加
         
         # ヘッダー行（1行目）に各問題類型の名前を追加
@@ -678,103 +2351,874 @@ class ExcelReportGenerator:
             cell.value = section_name
             cell.font = openpyxl.styles.Font(bold=True)
         
-        # 各学生の行にスコアを追加
-        for row_num in range(2, self.data_sheet.max_row + 1):
-            if row_num in student_row_to_result:
-                result = student_row_to_result[row_num]
-                for col_idx, section_name in enumerate(section_names):
-                    col = start_col + col_idx
-                    section_score = result['section_scores'].get(section_name, {'score': 0})
-                    cell = self.data_sheet.cell(row_num, col)
-                    cell.value = section_score['score']
-    
-    def generate_reports(self, output_path=None):
-        """レポートを生成"""
+        # 受講者の行だけにスコアを書き込む（空行や名前のない行は走査しない）
+        for student, result in zip(students, results):
+            row_num = student['row']
+            for col_idx, section_name in enumerate(section_names, start_col):
+                section_score = result['section_scores'].get(section_name, {'score': 0})
+                self.data_sheet.cell(row_num, col_idx).value = section_score['score']
+    
+    def create_score_sheet(self, students, results, sections_data, spool_rows=None):
+        """
+        取得データシートを広げずに、各問題類型のスコアを別の「集計スコア」シートに出力
+        spool_rows を指定した場合、受講者の行は spool_rows 行ごとに一時ファイルへ書き出す（spool_sheet_rows を参照）
+        """
+        score_name = "集計スコア"
+        if score_name in self.wb.sheetnames:
+            self.wb.remove(self.wb[score_name])
+        score_sheet = self.wb.create_sheet(score_name)
+        
+        # ヘッダー行（取得データシートの行番号で元データと対応付けられるようにする）
+        section_names = list(sections_data.keys())
+        headers = ['取得データ行', '氏名', 'メールアドレス'] + section_names + ['合計']
+        for col, header in enumerate(headers, 1):
+            cell = score_sheet.cell(1, col)
+            cell.value = header
+            cell.font = openpyxl.styles.Font(bold=True)
+        
+        spool = self.spool_sheet_rows(score_sheet, 2, spool_rows)
+        
+        # データ行
+        for row_idx, (student, result) in enumerate(zip(students, results), 2):
+            score_sheet.cell(row_idx, 1).value = student['row']
+            score_sheet.cell(row_idx, 2).value = result['name']
+            score_sheet.cell(row_idx, 3).value = result.get('email', '')
+            for col_idx, section_name in enumerate(section_names, 4):
+                section_score = result['section_scores'].get(section_name, {'score': 0})
+                score_sheet.cell(row_idx, col_idx).value = section_score['score']
+            score_sheet.cell(row_idx, len(headers)).value = result['total_score']
+            if spool:
+                spool.row_written(row_idx)
+        if spool:
+            spool.flush()
+        
+        for col in range(1, len(headers) + 1):
+            score_sheet.column_dimensions[get_column_letter(col)].width = 20
+    
+    # 結果ファイルの形式と拡張子
+    EXPORT_FORMATS = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+    
+    def iter_result_records(self, results, points_data, sections_data):
+        """
+        採点結果を1受講者1レコードの辞書として順に返す（BIツール取り込み用）
+        セクション別の得点・5点評価と、問題ごとの正誤（q{問題番号}: 1=正解、0=不正解）を含む
+        """
+        for result in results:
+            record = {
+                'name': result['name'],
+                'email': result.get('email', ''),
+                'total_score': result['total_score'],
+                'max_score': result['max_score'],
+                'percentage': round(result['percentage'], 2),
+                'rating': result['rating'],
+                'rank': result.get('rank'),
+                'percentile': result.get('percentile'),
+            }
+            for section_name in sections_data.keys():
+                section_score = result['section_scores'].get(section_name, {'score': 0, 'max_score': 0})
+                record[f'{section_name}_score'] = section_score['score']
+                record[f'{section_name}_rating'] = round(
+                    (section_score['score'] / section_score['max_score']) * 5, 2
+                ) if section_score['max_score'] > 0 else 0
+            answers = result['answers']
+            for point_info in points_data:
+                index = point_info['question_num'] - 1
+                record[f"q{point_info['question_num']}"] = 1 if index < len(answers) and answers[index] == 1 else 0
+            yield record
+    
+    def export_results(self, records, export_path, export_format=None, batch_size=1000):
+        """
+        結果レコードを CSV / JSON Lines / Parquet 形式で書き出す
+        records はジェネレータのまま1件ずつ（Parquetは batch_size 件ずつ）書き込み、一覧をメモリに溜めない
+        """
+        export_path = Path(export_path)
+        if export_format is None:
+            suffix = export_path.suffix.lower()
+            export_format = {'.ndjson': 'jsonl'}.get(suffix, suffix.lstrip('.'))
+        if export_format not in self.EXPORT_FORMATS:
+            raise Exception(f"対応していない出力形式です: {export_format}（csv / jsonl / parquet のいずれかを指定してください）")
+        
+        count = 0
+        if export_format == 'csv':
+            # Excelで開いても文字化けしないようBOM付きUTF-8で出力
+            with open(export_path, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = None
+                for record in records:
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=list(record.keys()))
+                        writer.writeheader()
+                    writer.writerow(record)
+                    count += 1
+        elif export_format == 'jsonl':
+            with open(export_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    count += 1
+        else:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception("Parquet形式で出力するには pyarrow が必要です（pip install pyarrow）")
+            writer = None
+            batch = []
+            try:
+                for record in records:
+                    batch.append(record)
+                    count += 1
+                    if len(batch) >= batch_size:
+                        table = pa.Table.from_pylist(batch, schema=writer.schema if writer else None)
+                        if writer is None:
+                            writer = pq.ParquetWriter(str(export_path), table.schema)
+                        writer.write_table(table)
+                        batch = []
+                if batch or writer is None:
+                    table = pa.Table.from_pylist(batch, schema=writer.schema if writer else None)
+                    if writer is None:
+                        writer = pq.ParquetWriter(str(export_path), table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+        
+        return count
+    
+    # 実行計画の判定基準
+    OUT_OF_CORE_RESPONDENTS = 5000  # これ以上の受講者数は回答データを一時ファイルに書き出す
+    STATIC_VALUES_REPORTS = 1000  # これ以上のレポート数は値での出力を勧める（数式が既定のため自動では切り替えない）
+    APPEND_DATA_CELLS = 1000000  # 取得データのセル数がこれ以上なら元のファイルに追記して保存する
+    SHARD_REPORTS = 2000  # これ以上のレポート数は複数ファイルに分けて保存する
+    SHARD_SIZE = 1000  # 分割時の1ファイルあたりのレポート数
+    
+    def parse_dimension(self, ref):
+        """<dimension ref="A1:GM54"> の範囲から (行数, 列数) を取得"""
+        match = re.fullmatch(r'\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?', ref.upper())
+        if not match:
+            return None, None
+        start_col, start_row, end_col, end_row = match.groups()
+        end_col = end_col or start_col
+        end_row = end_row or start_row
+        return (
+            int(end_row) - int(start_row) + 1,
+            column_index_from_string(end_col) - column_index_from_string(start_col) + 1
+        )
+    
+    def scan_workbook(self, file_path):
+        """
+        ファイル全体を読み込まずに、zip内の各シートの <dimension> と共有文字列数だけを読み取る
+        戻り値: {'file_size', 'shared_strings', 'sheets': {シート名: {'rows', 'columns'}}}
+        """
+        scan = {'file_size': os.path.getsize(file_path), 'shared_strings': None, 'sheets': {}}
+        with zipfile.ZipFile(file_path) as archive:
+            part_names = set(archive.namelist())
+            for name, part in XlsmAppendWriter.get_sheet_parts(archive):
+                rows, columns = None, None
+                if part in part_names:
+                    # <dimension> はシートの先頭付近にあるため、先頭部分だけを読む
+                    with archive.open(part) as f:
+                        head = f.read(4096).decode('utf-8', errors='ignore')
+                    match = re.search(r'<dimension\b[^>]*\bref=["\']([^"\']+)["\']', head)
+                    if match:
+                        rows, columns = self.parse_dimension(match.group(1))
+                scan['sheets'][name] = {'rows': rows, 'columns': columns}
+            
+            rels_xml = archive.read(XlsmAppendWriter.WORKBOOK_RELS_PART).decode('utf-8-sig')
+            targets = [XlsmAppendWriter.get_part_path(attributes['Target'])
+                       for element, attributes in XlsmAppendWriter.iter_relationships(rels_xml)]
+            shared_strings_part = next(
+                (part for part in targets if part.endswith('sharedStrings.xml')), None
+            )
+            if shared_strings_part in part_names:
+                with archive.open(shared_strings_part) as f:
+                    head = f.read(1024).decode('utf-8', errors='ignore')
+                match = (re.search(r'<sst\b[^>]*\buniqueCount=["\'](\d+)', head)
+                         or re.search(r'<sst\b[^>]*\bcount=["\'](\d+)', head))
+                if match:
+                    scan['shared_strings'] = int(match.group(1))
+        return scan
+    
+    # 受講者数を数える際の行・セル（r 属性は省略できるため、省略された場合は直前の行・セルの次として数える）
+    ROW_PATTERN = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+    CELL_PATTERN = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+    REF_ATTRIBUTE_PATTERN = re.compile(r'\br=["\']\$?([A-Za-z]*)\$?(\d*)["\']')
+    NAME_COLUMN = 12  # 氏名の列（L列）
+    
+    def count_respondents(self, file_path, sheet_name, block_size=1024 * 1024):
+        """
+        取得データシートのXMLを先頭から順に読み、氏名（L列）に値（<v> または <is>）がある2行目以降の行数を数える
+        （<dimension> は書式だけの行も含むため、受講者数の上限にしかならない）
+        行・セルの位置は r 属性から取得し、r 属性がない場合は直前の行・セルの次の位置とする
+        シート全体をメモリに読み込まず、block_size バイトずつ読んで </row> までの行ごとに確認する
+        """
+        with zipfile.ZipFile(file_path) as archive:
+            part = dict(XlsmAppendWriter.get_sheet_parts(archive)).get(sheet_name)
+            if part is None or part not in archive.namelist():
+                return None
+            count = 0
+            row_num = 0
+            pending = ''
+            with archive.open(part) as f, io.TextIOWrapper(f, encoding='utf-8', errors='ignore') as text:
+                while True:
+                    block = text.read(block_size)
+                    pending += block
+                    if block:
+                        # 途中で切れた行は次のブロックと合わせて確認する
+                        end = pending.rfind('</row>')
+                        end = end + len('</row>') if end >= 0 else 0
+                    else:
+                        end = len(pending)
+                    for row_match in self.ROW_PATTERN.finditer(pending, 0, end):
+                        ref = self.REF_ATTRIBUTE_PATTERN.search(row_match.group(1))
+                        row_num = int(ref.group(2)) if ref and ref.group(2) else row_num + 1
+                        if row_num > 1 and self.has_name_value(row_match.group(2) or ''):
+                            count += 1
+                    pending = pending[end:]
+                    if not block:
+                        return count
+    
+    def has_name_value(self, row_xml):
+        """行のXMLで、氏名の列（L列）のセルに値があるかを確認する（L列より右のセルは確認しない）"""
+        col = 0
+        for match in self.CELL_PATTERN.finditer(row_xml):
+            ref = self.REF_ATTRIBUTE_PATTERN.search(match.group(1))
+            col = column_index_from_string(ref.group(1).upper()) if ref and ref.group(1) else col + 1
+            if col >= self.NAME_COLUMN:
+                return col == self.NAME_COLUMN and re.search(r'<(?:v|is)\b', match.group(2) or '') is not None
+        return False
+    
+    def plan_execution(self, file_path, overrides=None):
+        """
+        事前スキャンの結果から実行方法を決める（ワークブックを読み込む前に呼び出す）
+        戻り値の 'options' は generate_reports に渡す引数、'read_only' は load_workbook に渡す引数、
+        'reasons' は判断理由（ログ表示用）
+        overrides を指定した場合、その値（False・None を含む）を判断結果より優先する
+        """
+        scan = self.scan_workbook(file_path)
+        data_sheet = next((name for name in scan['sheets'] if '取得データ' in name or '取得' in name), None)
+        data_dimension = scan['sheets'].get(data_sheet, {'rows': None, 'columns': None})
+        rows, columns = data_dimension['rows'], data_dimension['columns']
+        if rows is not None and rows <= 1:
+            # 1セルだけの範囲（"A1" のまま更新されていないなど）は記録がないものとして扱う
+            rows, columns = None, None
+        
+        # <dimension> の行数は書式だけの行も含むため、受講者数の上限としてだけ使う
+        # 上限がいずれかの基準に届く場合や範囲の記録がない場合は、氏名のある行を数える
+        respondents = max(rows - 1, 0) if rows is not None else None  # ヘッダー行を除く
+        counted = False
+        smallest_threshold = min(self.OUT_OF_CORE_RESPONDENTS, self.STATIC_VALUES_REPORTS, self.SHARD_REPORTS)
+        if data_sheet is not None and (respondents is None or respondents >= smallest_threshold):
+            respondents = self.count_respondents(file_path, data_sheet)
+            counted = respondents is not None
+        
+        options = {}
+        reasons = []
+        if respondents is None:
+            # 取得データシートを読み取れない場合は既定の方法で実行する
+            reasons.append("取得データシートの受講者数を取得できないため、既定の設定で実行します")
+        else:
+            reasons.append(
+                f"取得データ: {f'{respondents}名' if counted else f'最大{respondents}名'} × "
+                f"{f'{columns}列' if columns else '列数不明'}、共有文字列 {scan['shared_strings'] or 0}件、"
+                f"ファイルサイズ {scan['file_size'] / 1024 / 1024:.1f}MB"
+            )
+            
+            options['out_of_core'] = respondents >= self.OUT_OF_CORE_RESPONDENTS
+            reasons.append(
+                f"回答データ: {'一時ファイルに書き出して分割採点' if options['out_of_core'] else 'メモリ上で採点'}"
+                f"（{self.OUT_OF_CORE_RESPONDENTS}名以上で一時ファイルを使用）"
+            )
+            
+            # 数式は得点を手動で修正する場合のために既定のままとし、大人数の場合は値での出力を勧めるだけにする
+            options['use_formulas'] = True
+            reasons.append(
+                "星レビュー・平均行: 数式（既定）" + (
+                    f"。{self.STATIC_VALUES_REPORTS}件以上のレポートは、計算済みの値で出力するとExcelで開く際の再計算を省略できます"
+                    if respondents >= self.STATIC_VALUES_REPORTS else ""
+                )
+            )
+            
+            options['append_to_original'] = bool(columns) and (respondents + 1) * columns >= self.APPEND_DATA_CELLS
+            reasons.append(
+                f"保存方法: {'元のファイルに新しいシートだけを追記' if options['append_to_original'] else 'ブック全体を保存'}"
+                f"（取得データが{self.APPEND_DATA_CELLS}セル以上で追記）"
+            )
+            
+            options['shard_size'] = self.SHARD_SIZE if respondents >= self.SHARD_REPORTS else None
+            reasons.append(
+                f"出力ファイル: {f'{self.SHARD_SIZE}件ずつ分割' if options['shard_size'] else '1ファイル'}"
+                f"（{self.SHARD_REPORTS}件以上のレポートは分割）"
+            )
+            # openpyxlのワークブックは複数スレッドから同時に書き込めないため、レポート作成は常に逐次処理
+            reasons.append("レポート作成: 逐次処理")
+        
+        for key, value in (overrides or {}).items():
+            options[key] = value
+            reasons.append(f"指定により上書き: {key}={value}")
+        
+        # 省メモリモード・追記モードでは取得データシートのセルをメモリに展開しないよう、読み取り専用で読み込む
+        # （追記モードでは取得データシートを元のファイルからそのままコピーするため、レポートの作成時も読み込まない）
+        read_only = bool(options.get('out_of_core') or options.get('append_to_original'))
+        reasons.append(f"読み込み: {'読み取り専用' if read_only else '通常'}（省メモリモード・追記モードでは読み取り専用）")
+        
+        return {
+            'respondents': respondents,
+            'columns': columns,
+            'shared_strings': scan['shared_strings'],
+            'read_only': read_only,
+            'options': options,
+            'reasons': reasons,
+        }
+    
+    def save_output(self, output_path, append_to_original=False, sheet_chunks=None, chunk_sheets_only=False):
+        """
+        ワークブックを保存し、実際に保存したパスを返す（ファイルオブジェクトの場合はそのまま書き込む）
+        sheet_chunks を指定した場合（追記モードのみ）、作成済みの新しいシートを書き込んだ後、
+        sheet_chunks から受け取ったシートのリストを順に書き込み、書き込んだシートはワークブックから取り除く
+        （新しいシートをすべてメモリ上に作成してから保存しない）
+        chunk_sheets_only=True の場合、sheet_chunks から受け取ったシートだけを含むファイル（.xlsx）を保存する
+        """
+        if hasattr(output_path, 'write'):
+            self.write_output(output_path, append_to_original, sheet_chunks, chunk_sheets_only)
+            return output_path
+        
+        # 既存のファイルが存在し、開かれている場合はタイムスタンプを追加
+        output_path_obj = Path(output_path)
+        if output_path_obj.exists():
+            try:
+                # 削除を試みる（開かれていない場合）
+                output_path_obj.unlink()
+                output_path_str = str(output_path_obj)
+            except (PermissionError, OSError):
+                # ファイルが開かれている場合はタイムスタンプを追加
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                base_name = output_path_obj.stem
+                suffix = output_path_obj.suffix
+                output_path_str = str(output_path_obj.parent / f"{base_name}_{timestamp}{suffix}")
+        else:
+            # ファイルが存在しない場合はそのまま使用
+            output_path_str = str(output_path_obj)
+        
+        # ファイルを保存
+        try:
+            self.write_output(output_path_str, append_to_original, sheet_chunks, chunk_sheets_only)
+        except PermissionError:
+            raise Exception(
+                f"ファイルの保存に失敗しました。\n"
+                f"以下の可能性があります：\n"
+                f"1. 出力ファイルが既にExcelで開かれている\n"
+                f"2. ファイルのアクセス権限がない\n"
+                f"3. ディレクトリへの書き込み権限がない\n\n"
+                f"ファイル: {Path(output_path_str).name}\n"
+                f"パス: {Path(output_path_str).parent}"
+            )
+        
+        return output_path_str
+    
+    def write_output(self, output_path, append_to_original=False, sheet_chunks=None, chunk_sheets_only=False):
+        """save_output の保存処理（保存先のパスは確定済み）"""
+        if chunk_sheets_only:
+            # 現時点のシートはすべて書き込まず、sheet_chunks で作成されるシートだけを書き込む
+            writer = XlsmAppendWriter(
+                self.original_file_path, self.wb, list(self.wb.worksheets) + list(self.wb.chartsheets),
+                keep_original_sheets=False
+            )
+        elif not append_to_original:
+            if sheet_chunks is not None:
+                raise Exception("シートを分けて書き込めるのは追記モードで保存する場合のみです")
+            self.wb.save(output_path)
+            return
+        else:
+            writer = XlsmAppendWriter(self.original_file_path, self.wb, self.original_sheets, row_spools=self.row_spools)
+        if sheet_chunks is None:
+            writer.save(output_path)
+            return
+        writer.open(output_path)
+        try:
+            writer.write_sheets()  # 作成済みの新しいシート（集計シートなど）
+            for sheets in sheet_chunks:
+                writer.write_sheets(sheets)
+                for sheet in sheets:
+                    self.wb.remove(sheet)
+                # シートとセルは互いに参照しているため、取り除いたシートは循環参照の回収まで解放されない
+                del sheets
+                gc.collect()
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+    
+    # 取得データシートのセルを読み込まない場合に、取得データシートの代わりに読み込む空のシート
+    EMPTY_WORKSHEET_XML = '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData/></worksheet>'
+    
+    def load_render_workbook(self, strip_data_sheet=False):
+        """
+        読み取り専用で読み込んで受講者データを読み込んだ後、レポートを作成するための書き込み可能なワークブックを読み込む
+        strip_data_sheet=True の場合、取得データシートのセルは読み込まない（追記モードでは取得データシートを
+        元のファイルからそのままコピーするため、受講者全員分のセルをメモリに展開しない）
+        受講者データの読み込みで求めた取得データの列数・最後の列はそのまま引き継ぐ
+        """
+        source_path = self.original_file_path
+        sheet_titles = [self.data_sheet.title, self.point_sheet.title, self.template_sheet.title]
+        self.wb.close()
+        
+        if strip_data_sheet:
+            # 取得データシートのパーツを空のシートに置き換えたコピーを一時ファイルに作成して読み込む
+            # （シートのリレーションシップも除き、コメント・テーブルなども読み込まない）
+            with zipfile.ZipFile(source_path) as source, tempfile.TemporaryFile() as stripped:
+                data_part = dict(XlsmAppendWriter.get_sheet_parts(source)).get(sheet_titles[0])
+                with zipfile.ZipFile(stripped, 'w', zipfile.ZIP_STORED, allowZip64=True) as target:
+                    for info in source.infolist():
+                        if info.filename == data_part:
+                            target.writestr(data_part, self.EMPTY_WORKSHEET_XML)
+                        elif data_part is None or info.filename != XlsmAppendWriter.get_rels_part(data_part):
+                            XlsmAppendWriter.copy_compressed_part(source, target, info)
+                stripped.seek(0)
+                wb = load_workbook(stripped)
+        else:
+            wb = load_workbook(source_path, keep_vba=True)
+        
+        self.wb = wb
+        self.original_sheets = list(wb.worksheets) + list(wb.chartsheets)
+        self.data_sheet, self.point_sheet, self.template_sheet = (wb[title] for title in sheet_titles)
+        self.sheet_registry = None
+    
+    def generate_reports(self, output_path=None, use_formulas=True, out_of_core=False, chunk_size=1000, separate_score_sheet=False, append_to_original=False, export_path=None, export_format=None, results_only=False, shard_size=None):
+        """
+        レポートを生成
+        use_formulas=False の場合、星レビューと平均行を数式ではなく計算済みの値で書き込む
+        （数千シート規模でもExcelで開く際の再計算が不要になる）
+        out_of_core=True の場合、回答データを一時ファイル上の AnswerMatrix に書き出し、
+        chunk_size 人ずつ採点する（数万人規模でも回答リストをメモリに保持しない）
+        ファイルは load_workbook(read_only=True) で読み込んでおく。レポートの作成には取得データシートのセルを
+        読み込まないワークブックを使い、追記モードで保存する（スコア列は「集計スコア」シートに出力する）
+        個別レポートシートは chunk_size 件ずつ作成してファイルに書き込む
+        AnswerMatrix は終了時に閉じるため、戻り値の結果の 'answers' と 'question_scores' は参照できない
+        separate_score_sheet=True の場合、スコア列は取得データシートに追加せず「集計スコア」シートに出力する
+        append_to_original=True の場合、元のファイルのパーツはそのままコピーし、新しいシートだけを追加して保存する
+        （元のシートは変更できないため、スコア列は常に「集計スコア」シートに出力する）
+        ファイルを load_workbook(read_only=True) で読み込んでおけば、レポートの作成時も取得データシートのセルは読み込まない
+        （通常の読み込みの場合は、読み込み時にブック全体を展開している）
+        export_path / export_format を指定した場合、採点結果を CSV / JSON Lines / Parquet でも書き出す
+        results_only=True の場合、結果ファイルだけを書き出し、ワークブックの作成・保存は行わない
+        （戻り値の出力パスは結果ファイルのパスになる）
+        shard_size を指定した場合、個別レポートシートは shard_size 件ずつ「{出力ファイル名}_1.xlsx」「_2.xlsx」...に
+        レポートシートだけを分けて保存し、出力ファイルには集計シートなどそれ以外のシートを保存する
+        （戻り値の出力パスは出力ファイル、各受講者のレポートを含むファイルは result['output_path'] に設定する）
+        """
         try:
             # シートを検索
             self.find_sheets()
             
             # データを読み込む
-            points_data, sections_data, section_names, problems, total_problems = self.read_point_data()
-            students = self.read_student_data(points_data, sections_data)
+            points_data, sections_data, students, answer_matrix = self.read_input(out_of_core=out_of_core)
+            try:
+                return self.score_and_render(
+                    students, points_data, sections_data, answer_matrix, output_path,
+                    use_formulas=use_formulas, chunk_size=chunk_size,
+                    separate_score_sheet=separate_score_sheet, append_to_original=append_to_original,
+                    export_path=export_path, export_format=export_format,
+                    results_only=results_only, shard_size=shard_size
+                )
+            finally:
+                # 一時ファイルを削除する
+                if answer_matrix is not None:
+                    answer_matrix.close()
+            
+        except Exception as e:
+            raise Exception(f"レポート生成中にエラーが発生しました: {str(e)}\n{traceback.format_exc()}")
+    
+    def score_and_render(self, students, points_data, sections_data, answer_matrix, output_path, use_formulas=True, chunk_size=1000, separate_score_sheet=False, append_to_original=False, export_path=None, export_format=None, results_only=False, shard_size=None):
+        """generate_reports の読み込み後の処理（採点、結果ファイルの書き出し、レポートの作成・保存）"""
+        out_of_core = answer_matrix is not None
+        # 得点を計算
+        results = self.calculate_scores(
+            students, points_data, sections_data, answer_matrix=answer_matrix, chunk_size=chunk_size
+        )
+        
+        # 順位・パーセンタイルを計算
+        self.calculate_cohort_standings(results, sections_data)
+        
+        # 採点結果をファイルに書き出す
+        if export_format and not export_path:
+            if not self.original_file_path:
+                raise Exception("元のファイルパスが設定されていません")
+            base_path = Path(self.original_file_path)
+            export_path = base_path.parent / f"{base_path.stem}_結果{self.EXPORT_FORMATS.get(export_format, '')}"
+        if export_path:
+            self.export_results(
+                self.iter_result_records(results, points_data, sections_data), export_path, export_format
+            )
+        elif results_only:
+            raise Exception("結果ファイルのみ出力する場合は出力形式を指定してください")
+        
+        if results_only:
+            if self.wb.read_only:
+                # 読み取り専用で開いたファイルを解放する
+                self.wb.close()
+            return results, str(export_path)
+        
+        # ファイルを保存
+        if output_path:
+            # 出力パスが指定されている場合
+            base_output_path = Path(output_path)
+        else:
+            # 元のファイル名に「_出力」を追加
+            if self.original_file_path:
+                base_path = Path(self.original_file_path)
+                base_output_path = base_path.parent / f"{base_path.stem}_出力{base_path.suffix}"
+            else:
+                raise Exception("元のファイルパスが設定されていません")
+        
+        if self.wb.read_only:
+            # 読み取り専用で読み込んだ場合は、書き込み可能なワークブックを読み込み直す
+            # （省メモリモードでは取得データシートのセルは読み込まず、追記モードで保存する）
+            self.load_render_workbook(strip_data_sheet=out_of_core or append_to_original)
+        
+        output_paths = self.render_workbook(
+            students, results, points_data, sections_data, base_output_path,
+            use_formulas=use_formulas,
+            separate_score_sheet=separate_score_sheet,
+            append_to_original=append_to_original or out_of_core,
+            shard_size=shard_size,
+            chunk_size=chunk_size if out_of_core else None
+        )
+        return results, output_paths[0]
+    
+    def read_input(self, out_of_core=False, anomalies=None):
+        """
+        配点データと受講者データを読み込む（戻り値: 配点データ, セクション情報, 受講者データ, AnswerMatrix）
+        読み込みに失敗した場合、作成した AnswerMatrix は閉じてから例外を送出する
+        """
+        points_data, sections_data, section_names, problems, total_problems = self.read_point_data()
+        answer_matrix = AnswerMatrix(len(self.get_answer_columns())) if out_of_core else None
+        try:
+            students = self.read_student_data(points_data, sections_data, answer_matrix=answer_matrix, anomalies=anomalies)
             
             if not students:
                 raise Exception("受講者データが見つかりません")
             
             if not points_data:
                 raise Exception("配点データが見つかりません")
+        except Exception:
+            if answer_matrix is not None:
+                answer_matrix.close()
+            raise
+        
+        return points_data, sections_data, students, answer_matrix
+    
+    def validate(self, out_of_core=False, chunk_size=1000):
+        """
+        レポートを作成せずに、読み込みと採点だけを行ってデータを検証する（ドライラン）
+        - 配点シートの問題番号と取得データの回答列の対応（回答列の有無、設問文の一致、重複）
+        - 0/1以外の回答（通常の実行では0として扱われる）
+        - 氏名の重複
+        戻り値: {'anomalies': [{'sheet', 'cell', 'message'}, ...], 'summary': 受講者全体の集計}
+        """
+        self.find_sheets()
+        anomalies = []
+        
+        # 受講者データを読み込んで採点する（0/1以外の回答はここで検出）
+        points_data, sections_data, students, answer_matrix = self.read_input(
+            out_of_core=out_of_core, anomalies=anomalies
+        )
+        try:
+            results = self.calculate_scores(
+                students, points_data, sections_data, answer_matrix=answer_matrix, chunk_size=chunk_size
+            )
             
-            # 得点を計算
-            results = self.calculate_scores(students, points_data, sections_data)
-            
-            # 取得データシートに各問題類型のスコア列を追加
-            self.update_data_sheet(students, results, sections_data)
-            
-            # 集計シートを作成
-            self.create_summary_sheet(results, sections_data, points_data)
+            # 配点シートの問題番号と取得データの回答列を照合
+            answer_cols = self.get_answer_columns()
+            header = next(self.data_sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            first_rows = {}
+            for point_info in points_data:
+                question_num = point_info['question_num']
+                point_cell = f"D{point_info['row']}"
+                if question_num in first_rows:
+                    anomalies.append({
+                        'sheet': self.point_sheet.title,
+                        'cell': point_cell,
+                        'message': f"問題番号 {question_num} が重複しています（D{first_rows[question_num]} と同じ）",
+                    })
+                    continue
+                first_rows[question_num] = point_info['row']
             
-            # 5点評価シートを作成
-            self.create_rating_sheet(results, sections_data)
+                if not 1 <= question_num <= len(answer_cols):
+                    anomalies.append({
+                        'sheet': self.point_sheet.title,
+                        'cell': point_cell,
+                        'message': f"問題番号 {question_num} に対応する回答列が取得データにありません（回答列は{len(answer_cols)}問分）",
+                    })
+                    continue
             
-            # 個別レポートシートを作成
-            template_sheet_name = self.template_sheet.title
-            for idx, result in enumerate(results, 3):  # 3行目から開始（ヘッダー行が2行目）
-                self.create_report_sheet(result, template_sheet_name, idx, all_results=results, sections_data=sections_data)
+                # 回答列の前後（設問・点数・フィードバック列）の見出しに配点シートの設問文が含まれるか
+                col = answer_cols[question_num - 1]
+                headers = [str(header[c - 1]) for c in (col - 1, col, col + 1) if c - 1 < len(header) and header[c - 1]]
+                if point_info['problem'] and not any(point_info['problem'] in text for text in headers):
+                    anomalies.append({
+                        'sheet': self.data_sheet.title,
+                        'cell': f"{get_column_letter(col)}1",
+                        'message': f"問題番号 {question_num} の回答列の見出しが配点シートの設問文（C{point_info['row']}）と一致しません",
+                    })
             
-            # ファイルを保存
-            if output_path:
-                # 出力パスが指定されている場合
-                base_output_path = Path(output_path)
-            else:
-                # 元のファイル名に「_出力」を追加
-                if self.original_file_path:
-                    base_path = Path(self.original_file_path)
-                    base_output_path = base_path.parent / f"{base_path.stem}_出力{base_path.suffix}"
+            # 氏名の重複
+            first_rows = {}
+            for student in students:
+                if student['name'] in first_rows:
+                    anomalies.append({
+                        'sheet': self.data_sheet.title,
+                        'cell': f"L{student['row']}",
+                        'message': f"氏名「{student['name']}」が重複しています（L{first_rows[student['name']]} と同じ）",
+                    })
                 else:
-                    raise Exception("元のファイルパスが設定されていません")
+                    first_rows[student['name']] = student['row']
             
-            # 既存のファイルが存在し、開かれている場合はタイムスタンプを追加
-            output_path_obj = base_output_path
-            if output_path_obj.exists():
-                try:
-                    # 削除を試みる（開かれていない場合）
-                    output_path_obj.unlink()
-                    output_path_str = str(output_path_obj)
-                except (PermissionError, OSError):
-                    # ファイルが開かれている場合はタイムスタンプを追加
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    base_name = output_path_obj.stem
-                    suffix = output_path_obj.suffix
-                    output_path_str = str(output_path_obj.parent / f"{base_name}_{timestamp}{suffix}")
-            else:
-                # ファイルが存在しない場合はそのまま使用
-                output_path_str = str(output_path_obj)
+            # 受講者全体の集計
+            count = len(results)
+            rating_distribution = {rating: 0 for rating in range(5, 0, -1)}
+            for result in results:
+                if result['rating'] in rating_distribution:
+                    rating_distribution[result['rating']] += 1
+            summary = {
+                'respondents': count,
+                'questions': len(points_data),
+                'answer_columns': len(answer_cols),
+                'max_score': results[0]['max_score'] if results else 0,
+                'average_score': self.average([result['total_score'] for result in results]),
+                'average_percentage': self.average([result['percentage'] for result in results]),
+                'section_averages': self.calculate_company_averages(results, sections_data),
+                'rating_distribution': rating_distribution,
+            }
             
-            # ファイルを保存
-            try:
-                self.wb.save(output_path_str)
-            except PermissionError:
-                raise Exception(
-                    f"ファイルの保存に失敗しました。\n"
-                    f"以下の可能性があります：\n"
-                    f"1. 出力ファイルが既にExcelで開かれている\n"
-                    f"2. ファイルのアクセス権限がない\n"
-                    f"3. ディレクトリへの書き込み権限がない\n\n"
-                    f"ファイル: {Path(output_path_str).name}\n"
-                    f"パス: {Path(output_path_str).parent}"
+        finally:
+            # 検証中に例外が発生した場合も一時ファイルを削除する
+            if answer_matrix is not None:
+                answer_matrix.close()
+        
+        return {'anomalies': anomalies, 'summary': summary}
+    
+    def format_validation_report(self, report):
+        """validate の結果を表示用の行のリストに変換"""
+        summary = report['summary']
+        lines = [
+            f"受講者数: {summary['respondents']}名",
+            f"問題数: {summary['questions']}問（取得データの回答列: {summary['answer_columns']}問分）",
+            f"平均点: {summary['average_score']:.2f} / {summary['max_score']:.0f}点（平均得点率 {summary['average_percentage']:.1f}%）",
+            "セクション別平均（5点評価）: " + "、".join(
+                f"{name} {value:.2f}" for name, value in summary['section_averages'].items()
+            ),
+            "評価の分布: " + "、".join(
+                f"{rating}: {count}名" for rating, count in summary['rating_distribution'].items()
+            ),
+        ]
+        if report['anomalies']:
+            lines.append(f"問題が{len(report['anomalies'])}件見つかりました:")
+            for anomaly in report['anomalies']:
+                lines.append(f"  [{anomaly['sheet']}!{anomaly['cell']}] {anomaly['message']}")
+        else:
+            lines.append("問題は見つかりませんでした。")
+        return lines
+    
+    def render_workbook(self, students, results, points_data, sections_data, output_path, use_formulas=True, separate_score_sheet=False, append_to_original=False, shard_size=None, chunk_size=None):
+        """
+        読み込み済みのワークブックに集計シート・個別レポートシートを作成して保存する
+        output_path にはファイルパスのほか、書き込み可能なファイルオブジェクトも指定できる（分割保存は不可）
+        chunk_size を指定した場合（追記モードのみ）、個別レポートシートは chunk_size 件ずつ作成してファイルに書き込み、
+        書き込んだシートはワークブックから取り除く（同時にメモリ上にあるレポートシートは chunk_size 件まで）
+        shard_size を指定した場合、個別レポートシートは shard_size 件ずつレポートシートだけのファイルに分けて保存する
+        追記モードで chunk_size を指定した場合、集計スコア・総合得点・5点評価シートの受講者の行も chunk_size 行ずつ
+        一時ファイルに書き出し、保存時にファイルへ挿入する（受講者全員分のセルをメモリに保持しない）
+        戻り値: 保存したファイルのパスのリスト（分割保存した場合は、出力ファイル、分割したファイルの順）
+        """
+        try:
+            return self.render_workbook_sheets(
+                students, results, points_data, sections_data, output_path, use_formulas, separate_score_sheet,
+                append_to_original, shard_size, chunk_size
+            )
+        finally:
+            self.close_row_spools()
+    
+    def render_workbook_sheets(self, students, results, points_data, sections_data, output_path, use_formulas, separate_score_sheet, append_to_original, shard_size, chunk_size):
+        """render_workbook の処理（SheetRowSpool の後始末は render_workbook で行う）"""
+        spool_rows = chunk_size if append_to_original else None
+        if separate_score_sheet or append_to_original:
+            # 各問題類型のスコアを「集計スコア」シートに出力
+            self.create_score_sheet(students, results, sections_data, spool_rows=spool_rows)
+        else:
+            # 取得データシートに各問題類型のスコア列を追加
+            self.update_data_sheet(students, results, sections_data)
+        
+        # 集計シートを作成
+        self.create_summary_sheet(results, sections_data, points_data, use_formulas=use_formulas, spool_rows=spool_rows)
+        
+        # 5点評価シートを作成
+        self.create_rating_sheet(results, sections_data, use_formulas=use_formulas, spool_rows=spool_rows)
+        
+        # 個別レポートシートを作成
+        template_sheet_name = self.template_sheet.title
+        company_avg = self.calculate_company_averages(results, sections_data)
+        # シート名の管理は実行ごとに1回だけ作成する（既存シート名はここで一度だけ取得）
+        self.sheet_registry = None
+        sheet_registry = self.get_sheet_registry(template_sheet_name)
+        
+        def create_report_sheets(report_results, row_offset):
+            return [
+                self.create_report_sheet(result, template_sheet_name, idx, all_results=results, sections_data=sections_data, use_formulas=use_formulas, company_avg=company_avg, sheet_registry=sheet_registry)
+                for idx, result in enumerate(report_results, row_offset)
+            ]
+        
+        def iter_report_sheet_chunks(report_results, row_offset, size):
+            for start in range(0, len(report_results), size):
+                yield create_report_sheets(report_results[start:start + size], row_offset + start)
+        
+        # 受講者の行番号（student_row_index）は3行目から開始（ヘッダー行が2行目）
+        if not (shard_size and len(results) > shard_size):
+            if chunk_size:
+                # レポートシートは保存中に chunk_size 件ずつ作成し、書き込んだものから取り除かれる
+                output_path_str = self.save_output(
+                    output_path, append_to_original=append_to_original,
+                    sheet_chunks=iter_report_sheet_chunks(results, 3, chunk_size)
                 )
-            
-            return results, output_path_str
-            
-        except Exception as e:
-            raise Exception(f"レポート生成中にエラーが発生しました: {str(e)}\n{traceback.format_exc()}")
+            else:
+                create_report_sheets(results, 3)
+                output_path_str = self.save_output(output_path, append_to_original=append_to_original)
+            for result in results:
+                result['output_path'] = output_path_str
+            return [output_path_str]
+        
+        # shard_size を指定した場合、個別レポートシートは shard_size 件ずつ、レポートシートだけを含む
+        # 「{出力ファイル名}_1.xlsx」「_2.xlsx」...に保存し、出力ファイルにはそれ以外のシートを保存する
+        if hasattr(output_path, 'write'):
+            raise Exception("ファイルオブジェクトへの出力では分割保存できません")
+        output_path = Path(output_path)
+        shard_paths = []
+        for shard_index, start in enumerate(range(0, len(results), shard_size)):
+            shard_results = results[start:start + shard_size]
+            shard_output_path = output_path.parent / f"{output_path.stem}_{shard_index + 1}.xlsx"
+            shard_path = self.save_output(
+                shard_output_path, chunk_sheets_only=True,
+                sheet_chunks=iter_report_sheet_chunks(shard_results, 3 + start, chunk_size or shard_size)
+            )
+            shard_paths.append(shard_path)
+            for result in shard_results:
+                result['output_path'] = shard_path
+        
+        # 個別レポートシートは各ファイルに書き込んだ時点でワークブックから取り除かれている
+        return [self.save_output(output_path, append_to_original=append_to_original)] + shard_paths
+
+
+# parse_workbook の読み込み結果（変更不可）
+# source_path: 元のファイルパス、points: 配点データ、sections: セクション情報、
+# students: 受講者データ、answer_matrix: 省メモリモードの AnswerMatrix（通常は None）
+class ReportInput(namedtuple('ReportInput', ['source_path', 'points', 'sections', 'students', 'answer_matrix'])):
+    """
+    省メモリモードでは一時ファイル（AnswerMatrix）を持つため、with 文で使用するか、
+    render_reports まで終わった後に close を呼ぶ（閉じた後は受講者の回答を参照できない）
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """AnswerMatrix の一時ファイルを閉じる（通常の読み込みでは何もしない）"""
+        if self.answer_matrix is not None:
+            self.answer_matrix.close()
+
+
+def freeze(value):
+    """辞書・リスト・RecordTable を読み取り専用の MappingProxyType・タプル・RecordTable に変換する"""
+    if isinstance(value, RecordTable):
+        return value if value.read_only else value.copy(read_only=True)
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# 以下の parse_workbook → score_results → render_reports は、ジョブごとに新しい
+# ExcelReportGenerator とワークブックを使い、引数を変更しない。共有する状態がないため、
+# 複数のジョブをスレッドプールなどから同時に実行できる（ロック不要）
+
+def parse_workbook(file_path, out_of_core=False):
+    """
+    Excelファイルを読み取り専用で読み込み、配点データと受講者データを返す
+    out_of_core=True の場合、戻り値の ReportInput は with 文で使用するか close を呼んで一時ファイルを削除する
+    """
+    generator = ExcelReportGenerator()
+    generator.load_workbook(file_path, read_only=True)
+    try:
+        generator.find_sheets()
+        points_data, sections_data, students, answer_matrix = generator.read_input(out_of_core=out_of_core)
+    finally:
+        generator.wb.close()
+    return ReportInput(str(file_path), freeze(points_data), freeze(sections_data), freeze(students), answer_matrix)
+
+
+def score_results(report_input, chunk_size=1000):
+    """受講者ごとの得点・5点評価・順位・パーセンタイルを計算して返す"""
+    generator = ExcelReportGenerator()
+    results = generator.calculate_scores(
+        report_input.students, report_input.points, report_input.sections,
+        answer_matrix=report_input.answer_matrix, chunk_size=chunk_size
+    )
+    generator.calculate_cohort_standings(results, report_input.sections)
+    return freeze(results)
+
+
+def render_reports(report_input, results, sink, use_formulas=True, separate_score_sheet=False, append_to_original=False, shard_size=None, chunk_size=1000):
+    """
+    元のファイルを新しく読み込み、集計シート・個別レポートシートを作成して sink に保存する
+    sink にはファイルパスまたは書き込み可能なファイルオブジェクトを指定する
+    省メモリモードで読み込んだ入力（answer_matrix あり）の場合、取得データシートのセルは読み込まずに追記モードで保存し、
+    個別レポートシートは chunk_size 件ずつ作成して書き込む
+    戻り値: シート名・出力パスを追加した結果
+    """
+    out_of_core = report_input.answer_matrix is not None
+    generator = ExcelReportGenerator()
+    generator.load_workbook(report_input.source_path, read_only=out_of_core)
+    generator.find_sheets()
+    if out_of_core:
+        generator.load_render_workbook(strip_data_sheet=True)
+    # 受け取った結果は変更せず、シート名などを追加するためのコピーを使う
+    if isinstance(results, RecordTable):
+        results = results.copy()
+    else:
+        results = [dict(result) for result in results]
+    generator.render_workbook(
+        report_input.students, results, report_input.points, report_input.sections, sink,
+        use_formulas=use_formulas,
+        separate_score_sheet=separate_score_sheet,
+        append_to_original=append_to_original or out_of_core,
+        shard_size=shard_size,
+        chunk_size=chunk_size if out_of_core else None
+    )
+    return freeze(results)
+
+
+def dry_run(file_path, out_of_core=False, chunk_size=1000):
+    """ファイルを読み取り専用で読み込み、レポートを作成せずに検証結果を返す"""
+    generator = ExcelReportGenerator()
+    generator.load_workbook(file_path, read_only=True)
+    try:
+        return generator.validate(out_of_core=out_of_core, chunk_size=chunk_size)
+    finally:
+        generator.wb.close()
 
 
 class ReportGeneratorUI:
+    # 採点結果ファイルの表示名と形式
+    EXPORT_FORMAT_LABELS = {"CSV": "csv", "JSON Lines": "jsonl", "Parquet": "parquet"}
+    # 出力オプションの選択肢と値（None は自動）
+    OPTION_CHOICES = {"自動": None, "オン": True, "オフ": False}
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Excel集計レポート生成ツール")
-        self.root.geometry("600x400")
+        self.root.geometry("640x620")
         
         self.generator = ExcelReportGenerator()
         self.file_path = None
@@ -796,6 +3240,54 @@ class ReportGeneratorUI:
         
         ttk.Button(file_frame, text="ファイルを選択", command=self.select_file).pack(side=tk.RIGHT)
         
+        # 出力オプション
+        option_frame = ttk.LabelFrame(main_frame, text="出力オプション", padding="10")
+        option_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(
+            option_frame,
+            text="「自動」の項目はファイルの規模から決めます（オン・オフを選んだ項目は自動設定より優先）"
+        ).pack(anchor=tk.W)
+        
+        self.static_values_var = self.add_option_choice(
+            option_frame, "数式を使わず計算済みの値で出力する（大量のシートを開く際の再計算を省略。自動では数式のまま）"
+        )
+        self.out_of_core_var = self.add_option_choice(
+            option_frame, "回答データを一時ファイルに書き出して省メモリで処理する（数万人規模向け）"
+        )
+        
+        self.separate_score_sheet_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            option_frame,
+            text="スコア列を取得データシートではなく「集計スコア」シートに出力する",
+            variable=self.separate_score_sheet_var
+        ).pack(anchor=tk.W)
+        
+        self.append_to_original_var = self.add_option_choice(
+            option_frame, "元のファイルはそのまま残し、新しいシートだけを追加して保存する（保存の高速化）"
+        )
+        self.shard_var = self.add_option_choice(
+            option_frame, f"個別レポートを{ExcelReportGenerator.SHARD_SIZE}件ずつ別のファイルに分けて保存する"
+        )
+        
+        export_frame = ttk.Frame(option_frame)
+        export_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(export_frame, text="採点結果ファイル:").pack(side=tk.LEFT)
+        self.export_format_var = tk.StringVar(value="出力しない")
+        ttk.Combobox(
+            export_frame,
+            textvariable=self.export_format_var,
+            values=["出力しない"] + list(self.EXPORT_FORMAT_LABELS.keys()),
+            state="readonly",
+            width=12
+        ).pack(side=tk.LEFT, padx=(5, 10))
+        self.results_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            export_frame,
+            text="結果ファイルのみ出力する（レポートを作成しない）",
+            variable=self.results_only_var
+        ).pack(side=tk.LEFT)
+        
         # 実行ボタン
         execute_frame = ttk.Frame(main_frame)
         execute_frame.pack(fill=tk.X, pady=10)
@@ -808,6 +3300,14 @@ class ReportGeneratorUI:
         )
         self.execute_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        self.dry_run_button = ttk.Button(
+            execute_frame,
+            text="検証のみ（ドライラン）",
+            command=self.dry_run,
+            state=tk.DISABLED
+        )
+        self.dry_run_button.pack(side=tk.LEFT, padx=(0, 10))
+        
         # 進捗表示
         self.progress = ttk.Progressbar(execute_frame, mode='indeterminate')
         self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
@@ -844,8 +3344,73 @@ class ReportGeneratorUI:
             self.file_path = file_path
             self.file_label.config(text=os.path.basename(file_path), foreground="black")
             self.execute_button.config(state=tk.NORMAL)
+            self.dry_run_button.config(state=tk.NORMAL)
             self.log(f"ファイルを選択しました: {os.path.basename(file_path)}")
     
+    def dry_run(self):
+        """レポートを作成せずにデータを検証"""
+        if not self.file_path:
+            messagebox.showerror("エラー", "ファイルを選択してください。")
+            return
+        
+        try:
+            self.dry_run_button.config(state=tk.DISABLED)
+            self.progress.start()
+            self.log("データを検証しています（レポートは作成しません）...")
+            
+            report = dry_run(self.file_path, out_of_core=self.OPTION_CHOICES[self.out_of_core_var.get()] is True)
+            for line in self.generator.format_validation_report(report):
+                self.log(line)
+            
+            self.progress.stop()
+            self.dry_run_button.config(state=tk.NORMAL)
+            
+            messagebox.showinfo(
+                "検証完了",
+                f"検証が完了しました。\n\n"
+                f"受講者数: {report['summary']['respondents']}名\n"
+                f"見つかった問題: {len(report['anomalies'])}件（詳細はログを参照）"
+            )
+            
+        except Exception as e:
+            self.progress.stop()
+            self.dry_run_button.config(state=tk.NORMAL)
+            error_msg = str(e)
+            self.log(f"エラー: {error_msg}")
+            messagebox.showerror("エラー", f"検証中にエラーが発生しました:\n{error_msg}")
+    
+    def add_option_choice(self, parent, text):
+        """「自動」「オン」「オフ」を選ぶ出力オプションを追加し、選択値の変数を返す"""
+        frame = ttk.Frame(parent)
+        frame.pack(fill=tk.X, anchor=tk.W)
+        variable = tk.StringVar(value="自動")
+        ttk.Combobox(
+            frame,
+            textvariable=variable,
+            values=list(self.OPTION_CHOICES.keys()),
+            state="readonly",
+            width=5
+        ).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(frame, text=text).pack(side=tk.LEFT)
+        return variable
+    
+    def get_overrides(self):
+        """「オン」「オフ」を選んだ出力オプションを generate_reports の引数として返す（「自動」の項目は含めない）"""
+        overrides = {}
+        static_values = self.OPTION_CHOICES[self.static_values_var.get()]
+        if static_values is not None:
+            overrides['use_formulas'] = not static_values
+        out_of_core = self.OPTION_CHOICES[self.out_of_core_var.get()]
+        if out_of_core is not None:
+            overrides['out_of_core'] = out_of_core
+        append_to_original = self.OPTION_CHOICES[self.append_to_original_var.get()]
+        if append_to_original is not None:
+            overrides['append_to_original'] = append_to_original
+        shard = self.OPTION_CHOICES[self.shard_var.get()]
+        if shard is not None:
+            overrides['shard_size'] = ExcelReportGenerator.SHARD_SIZE if shard else None
+        return overrides
+    
     def generate_reports(self):
         """レポートを生成"""
         if not self.file_path:
@@ -855,15 +3420,41 @@ class ReportGeneratorUI:
         try:
             self.execute_button.config(state=tk.DISABLED)
             self.progress.start()
-            self.log("Excelファイルを読み込んでいます...")
             
-            # ファイルを読み込む
-            self.generator.load_workbook(self.file_path)
+            export_format = self.EXPORT_FORMAT_LABELS.get(self.export_format_var.get())
+            results_only = self.results_only_var.get()
+            if results_only and not export_format:
+                raise Exception("結果ファイルのみ出力する場合は、採点結果ファイルの形式を選択してください。")
+            
+            # 「自動」の項目は既定値とし、レポートを作成する場合は事前スキャンで決める
+            # （「オン」「オフ」を選んだ項目は上書きとして優先する）
+            options = {'use_formulas': True, 'out_of_core': False, 'append_to_original': False, 'shard_size': None}
+            overrides = self.get_overrides()
+            if len(overrides) < len(options) and not results_only:
+                plan = self.generator.plan_execution(self.file_path, overrides=overrides)
+                for reason in plan['reasons']:
+                    self.log(f"実行計画: {reason}")
+                options.update(plan['options'])
+            else:
+                options.update(overrides)
+            
+            # ファイルを読み込む（結果ファイルのみ・省メモリモード・追記モードの場合は読み取り専用で読み込む）
+            # 実行計画は読み込み前に決めるため、読み込み方法にも反映される
+            self.log("Excelファイルを読み込んでいます...")
+            self.generator.load_workbook(
+                self.file_path,
+                read_only=results_only or options['out_of_core'] or options['append_to_original']
+            )
             self.log("ファイルの読み込みが完了しました。")
             
             # レポートを生成
             self.log("レポートを生成しています...")
-            results, output_path = self.generator.generate_reports()
+            results, output_path = self.generator.generate_reports(
+                separate_score_sheet=self.separate_score_sheet_var.get(),
+                export_format=export_format,
+                results_only=results_only,
+                **options
+            )
             
             self.progress.stop()
             self.execute_button.config(state=tk.NORMAL)
@@ -871,6 +3462,12 @@ class ReportGeneratorUI:
             self.log(f"レポート生成が完了しました！")
             self.log(f"出力ファイル: {output_path}")
             self.log(f"処理した受講者数: {len(results)}名")
+            output_paths = sorted({result['output_path'] for result in results if result.get('output_path')})
+            if len(output_paths) > 1:
+                self.log(f"個別レポートを{len(output_paths)}ファイルに分けて保存しました: {', '.join(output_paths)}")
+            for result in results:
+                if result.get('sheet_name') and result['sheet_name'] != result['name']:
+                    self.log(f"シート名を変更しました: {result['name']} → {result['sheet_name']}")
             
             messagebox.showinfo(
                 "完了",
@@ -888,6 +3485,13 @@ class ReportGeneratorUI:
 
 
 def main():
+    # python excel_report_generator.py --dry-run ファイル.xlsm で、GUIを使わずに検証結果を表示
+    if len(sys.argv) == 3 and sys.argv[1] == '--dry-run':
+        report = dry_run(sys.argv[2])
+        for line in ExcelReportGenerator().format_validation_report(report):
+            print(line)
+        sys.exit(1 if report['anomalies'] else 0)
+    
     root = tk.Tk()
     app = ReportGeneratorUI(root)
     root.mainloop()